@@ -1,8 +1,24 @@
+import logging
 import os
+import time
 
-from celery import Celery
+from celery import Celery, concurrency
+from celery.concurrency import prefork, solo
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
 from decouple import config
 
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bobbies_creator.settings")
 
 app = Celery("bobbies_creator")
@@ -11,3 +27,114 @@ app.autodiscover_tasks()
 
 app.conf.broker_url = config("CELERY_BROKER_URL")  # type: ignore
 app.conf.result_backend = config("CELERY_RESULT_BACKEND")  # type: ignore
+
+
+def has_process_signals(worker) -> bool:
+    # prefork e solo disparam worker_process_init/shutdown; os pools de
+    # threads, gevent e eventlet rodam as tasks no próprio processo do worker
+    pool_cls = concurrency.get_implementation(worker.pool_cls)
+    return issubclass(pool_cls, (prefork.TaskPool, solo.TaskPool))
+
+
+def warm_up():
+    # Paga aqui, e não na primeira task de cada processo, os imports pesados,
+    # o registro de plugins do PIL, a conexão com o banco e o primeiro uso
+    # do OpenCV
+    import cv2
+    import numpy as np
+    import openai  # noqa: F401
+    from django.db import connection
+    from google import genai  # noqa: F401
+    from PIL import Image
+
+    from core.services import local_converter
+
+    Image.init()
+    connection.ensure_connection()
+
+    gray_image = np.full((64, 64), 128, dtype=np.uint8)
+    sketch = local_converter.sketch_from_gray(gray_image, 21)
+    cv2.imdecode(
+        np.frombuffer(local_converter.encode_jpeg(sketch), dtype=np.uint8),
+        cv2.IMREAD_GRAYSCALE,
+    )
+
+
+def init_process():
+    # Um cliente por provedor de IA para todo o processo
+    from core.services import ai_clients
+
+    ai_clients.init_clients()
+
+    start = time.monotonic()
+    try:
+        warm_up()
+    except Exception:
+        # Sem warm start o worker ainda funciona, só a primeira task fica lenta
+        logger.exception("Worker warm start failed")
+    else:
+        logger.info("Worker warm start took %.2fs", time.monotonic() - start)
+
+
+def shutdown_process():
+    from core.services import ai_clients
+
+    ai_clients.close_clients()
+    metrics.process_exited(os.getpid())
+
+
+def init_worker_process(**kwargs):
+    init_process()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    shutdown_process()
+
+
+@worker_init.connect
+def init_worker(sender, **kwargs):
+    from django.conf import settings
+
+    # Antes do exportador: um erro nele não pode deixar os processos sem
+    # clientes de IA e sem warm start
+    if has_process_signals(sender):
+        # Conectado só agora para rodar depois do handler do fixup do Django,
+        # que fecha no processo filho as conexões herdadas do pai
+        worker_process_init.connect(init_worker_process, weak=False)
+    else:
+        init_process()
+
+    if settings.CELERY_METRICS_PORT:
+        try:
+            metrics.start_exporter(settings.CELERY_METRICS_PORT)
+        except OSError as error:
+            # Porta ocupada (outro worker no mesmo host): o worker sobe sem
+            # exportador
+            logger.warning(
+                "Metrics exporter not started on port %s: %s",
+                settings.CELERY_METRICS_PORT,
+                error,
+            )
+
+
+@worker_shutdown.connect
+def shutdown_worker(sender, **kwargs):
+    if not has_process_signals(sender):
+        shutdown_process()
+
+
+@before_task_publish.connect
+def add_publish_time(headers=None, **kwargs):
+    if headers is not None:
+        metrics.task_published(headers)
+
+
+@task_prerun.connect
+def task_started(task=None, **kwargs):
+    metrics.task_started(task)
+
+
+@task_postrun.connect
+def task_finished(task=None, task_id=None, state=None, **kwargs):
+    metrics.task_finished(task, task_id, state)
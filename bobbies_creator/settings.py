@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
 from decouple import Csv, config
 import stripe
 
@@ -139,6 +140,10 @@ else:
             "PASSWORD": config("DB_PASSWORD", default="postgres"),
             "HOST": config("DB_HOST", default="localhost"),
             "PORT": config("DB_PORT", default="5432"),
+            # Persistent connections for the Celery workers (set in compose);
+            # the ASGI web app keeps the default of one per request
+            "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=0, cast=int),
+            "CONN_HEALTH_CHECKS": True,
         }
     }
 
@@ -179,8 +184,118 @@ MEDIA_ROOT = BASE_DIR / "mediafiles/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Local converter (OpenCV)
+# Images above this pixel count are converted in strips of TILE_ROWS rows.
+# Only the intermediate buffers are strip-sized; the decoded image is not.
+LOCAL_CONVERTER_TILED_MIN_PIXELS = config(
+    "LOCAL_CONVERTER_TILED_MIN_PIXELS", default=16_000_000, cast=int
+)
+LOCAL_CONVERTER_TILE_ROWS = config("LOCAL_CONVERTER_TILE_ROWS", default=256, cast=int)
+# "exact" (cv2.GaussianBlur) or "fast" (blur on a downscaled level, see blur_fast)
+LOCAL_CONVERTER_ENGINE = config("LOCAL_CONVERTER_ENGINE", default="exact")
+
+# Least recently used conversions beyond this count are forgotten by the cache
+CONVERSION_CACHE_MAX_ENTRIES = config(
+    "CONVERSION_CACHE_MAX_ENTRIES", default=50_000, cast=int
+)
+
+# Widths (px) of the thumbnails generated for every uploaded/converted image
+THUMBNAIL_WIDTHS = config(
+    "THUMBNAIL_WIDTHS", default="160,320,640", cast=Csv(cast=int)  # type: ignore
+)
+
+# Cache (Redis), used by the live sketch preview
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": config("CACHE_URL", default="redis://redis:6379/1"),
+    }
+}
+
+# Live preview of the detail slider: longest side of the cached gray copy
+PREVIEW_MAX_SIZE = config("PREVIEW_MAX_SIZE", default=480, cast=int)
+PREVIEW_CACHE_TIMEOUT = config("PREVIEW_CACHE_TIMEOUT", default=60 * 60, cast=int)
+
+# AI generation: providers tried in this order until latency stats exist
+AI_PROVIDERS = config("AI_PROVIDERS", default="openai,gemini", cast=Csv())
+AI_ROUTER_WINDOW = config("AI_ROUTER_WINDOW", default=50, cast=int)
+AI_ROUTER_MAX_ERROR_RATE = config("AI_ROUTER_MAX_ERROR_RATE", default=0.5, cast=float)
+AI_ROUTER_COOLDOWN = config("AI_ROUTER_COOLDOWN", default=120, cast=float)
+# Seconds before a hedged request is sent to the next provider (0 disables)
+AI_HEDGE_AFTER_SECONDS = config("AI_HEDGE_AFTER_SECONDS", default=0, cast=float)
+# Reuse a previous generation of the same input/prompt/model (0 = never expires)
+AI_CACHE_TTL_SECONDS = config(
+    "AI_CACHE_TTL_SECONDS", default=30 * 24 * 60 * 60, cast=int
+)
+# Provider calls in flight at once when a whole book is generated by one task
+AI_BULK_CONCURRENCY = config("AI_BULK_CONCURRENCY", default=16, cast=int)
+
+# Prometheus: /metrics on the web app (Bearer token, disabled while
+# METRICS_TOKEN is empty) and an exporter started by each Celery worker on
+# CELERY_METRICS_PORT (0 disables it; several workers on one host need one
+# port each)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+CELERY_METRICS_PORT = config("CELERY_METRICS_PORT", default=0, cast=int)
+
+# Orphan files in MEDIA_ROOT are deleted by a periodic task, once they are older
+# than the grace period (files are saved before the rows that reference them)
+STORAGE_GC_GRACE_SECONDS = config(
+    "STORAGE_GC_GRACE_SECONDS", default=24 * 60 * 60, cast=int
+)
+STORAGE_GC_BATCH_SIZE = config("STORAGE_GC_BATCH_SIZE", default=1000, cast=int)
+
 # Celery Config
 CELERY_BROKER_URL = config("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = config("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
 CELERY_TASK_ALWAYS_EAGER = False
 CELERY_TASK_EAGER_PROPAGATES = False
+# Periodic tasks, run by the "celery_beat" service
+CELERY_BEAT_SCHEDULE = {
+    "collect-orphan-files": {
+        "task": "core.tasks.collect_orphan_files_task",
+        "schedule": crontab(hour=4, minute=0),
+    },
+}
+
+# Conversions with the same cache key (e.g. a double submit) run one at a time
+# across workers, so the second one reuses the first result (Redis lock)
+CONVERSION_LOCK_REDIS_URL = config(
+    "CONVERSION_LOCK_REDIS_URL", default=CELERY_BROKER_URL
+)
+CONVERSION_LOCK_TIMEOUT = config("CONVERSION_LOCK_TIMEOUT", default=300, cast=int)
+
+# Cluster-wide token buckets for the AI providers, shared by every worker
+# through Redis (0 = unlimited). Tasks over budget are retried later.
+AI_RATE_LIMIT_REDIS_URL = config("AI_RATE_LIMIT_REDIS_URL", default=CELERY_BROKER_URL)
+AI_RATE_LIMITS = {
+    "openai": {
+        "rpm": config("OPENAI_RPM", default=50, cast=int),
+        "ipm": config("OPENAI_IPM", default=20, cast=int),
+    },
+    "gemini": {
+        "rpm": config("GENAI_RPM", default=60, cast=int),
+        "ipm": config("GENAI_IPM", default=60, cast=int),
+    },
+}
+AI_RATE_LIMIT_BURST_SECONDS = config(
+    "AI_RATE_LIMIT_BURST_SECONDS", default=10, cast=float
+)
+AI_RATE_LIMIT_MAX_RETRIES = config("AI_RATE_LIMIT_MAX_RETRIES", default=30, cast=int)
+
+# Task completion pushed to the browser (Server-Sent Events over Redis pub/sub).
+# A stream is closed after TASK_EVENTS_STREAM_TIMEOUT and the browser reconnects.
+TASK_EVENTS_REDIS_URL = config("TASK_EVENTS_REDIS_URL", default=CELERY_BROKER_URL)
+TASK_EVENTS_STREAM_TIMEOUT = config("TASK_EVENTS_STREAM_TIMEOUT", default=300, cast=int)
+TASK_EVENTS_KEEPALIVE = config("TASK_EVENTS_KEEPALIVE", default=15, cast=int)
+
+# CPU-bound OpenCV work and network-bound AI calls run on their own queues,
+# each consumed by a worker with a matching pool (see the "celery_cpu" and
+# "celery_ai" services in docker-compose). Everything else stays on the
+# default "celery" queue.
+CELERY_TASK_ROUTES = {
+    "core.tasks.local_convert_image_task": {"queue": "cpu"},
+    "core.tasks.convert_book_page_task": {"queue": "cpu"},
+    "core.tasks.generate_ai_image_task": {"queue": "ai"},
+    "core.tasks.generate_book_ai_task": {"queue": "ai"},
+    "core.tasks.generate_thumbnails_task": {"queue": "cpu"},
+}
@@ -11,6 +11,9 @@ from core.models import (
     CreditTransaction,
     Book,
     UploadedImage,
+    ConversionCache,
+    ImageBlob,
+    BlobThumbnail,
 )
 
 
@@ -182,7 +185,7 @@ class UploadedImageAdmin(admin.ModelAdmin):
         "variations_count",
         "created_at",
     )
-    list_filter = ("default", "created_at", "book", "profile")
+    list_filter = ("default", "task_status", "created_at", "book", "profile")
     search_fields = ("title", "profile__username", "profile__email", "book__title")
     ordering = ("-created_at",)
     readonly_fields = ("created_at", "image_preview_large")
@@ -200,7 +203,7 @@ class UploadedImageAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;" />',
-                obj.image.url,
+                obj.thumbnail_url(160),
             )
         return "-"
 
@@ -210,7 +213,7 @@ class UploadedImageAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-width: 300px; max-height: 300px; object-fit: contain; border-radius: 8px;" />',
-                obj.image.url,
+                obj.thumbnail_url(640),
             )
         return "-"
 
@@ -222,6 +225,34 @@ class UploadedImageAdmin(admin.ModelAdmin):
     variations_count.short_description = "Variações"
 
 
+@admin.register(ConversionCache)
+class ConversionCacheAdmin(admin.ModelAdmin):
+    list_display = ("key", "image", "hits", "created_at", "last_used_at")
+    search_fields = ("key", "image__title")
+    ordering = ("-last_used_at",)
+    readonly_fields = ("created_at", "last_used_at")
+    autocomplete_fields = ("image",)
+
+
+class BlobThumbnailInline(admin.TabularInline):
+    model = BlobThumbnail
+    extra = 0
+    readonly_fields = ("name",)
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ("name", "ref_count", "created_at")
+    search_fields = ("name",)
+    ordering = ("-created_at",)
+    readonly_fields = ("name", "ref_count", "created_at")
+    inlines = [BlobThumbnailInline]
+
+
 # Customização do site admin
 admin.site.site_header = "📖 MyDraws - Administração"
 admin.site.site_title = "MyDraws Admin"
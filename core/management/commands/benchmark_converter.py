@@ -0,0 +1,227 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import local_converter
+
+DEFAULT_RESOLUTIONS = "640x480,1920x1080,4000x3000,8000x6000"
+DEFAULT_DETAIL_LEVELS = "5,21,51,101"
+DEFAULT_ENGINES = "exact,fast"
+
+
+def synthetic_image(width: int, height: int, seed: int = 42) -> np.ndarray:
+    # Imagem determinística com gradientes, formas com bordas duras e ruído,
+    # parecida o bastante com uma foto para exercitar blur e divide
+    rng = np.random.default_rng(seed)
+    base = (rng.random((max(height // 32, 2), max(width // 32, 2), 3)) * 255).astype(
+        np.uint8
+    )
+    image = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(min(width, height) // 20, min(width, height) // 5))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, center, radius, color, -1)
+
+    noise = rng.normal(0, 8, image.shape).astype(np.float32)
+    noise += image
+    return np.clip(noise, 0, 255, out=noise).astype(np.uint8)
+
+
+def peak_rss_mb() -> float:
+    # VmHWM é o pico do processo atual; o ru_maxrss do Linux é herdado do
+    # processo pai através do fork/exec e mascararia o valor real do caso
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(image_path: str, detail_level: int, engine: str, repeat: int, queue):
+    # Executado em um processo novo para que o pico de RSS seja só deste caso.
+    # A primeira execução não é medida (carga do OpenCV, threads, caches).
+    local_converter.converter(
+        image_path=image_path, detail_level=detail_level, engine=engine
+    )
+
+    timings = []
+    output_bytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sketch = local_converter.converter(
+            image_path=image_path,
+            detail_level=detail_level,
+            engine=engine,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+        output_bytes = len(sketch)
+        del sketch
+
+    queue.put(
+        {
+            "wall_time_ms": round(statistics.median(timings), 2),
+            "wall_time_min_ms": round(min(timings), 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "output_bytes": output_bytes,
+        }
+    )
+
+
+def idle_rss(queue):
+    queue.put(round(peak_rss_mb(), 1))
+
+
+def parse_resolution(value: str) -> tuple[int, int]:
+    try:
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise CommandError(f"Invalid resolution '{value}', expected WIDTHxHEIGHT")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark core.services.local_converter on synthetic images and "
+        "optionally compare the results against a previous run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS)
+        parser.add_argument("--detail-levels", default=DEFAULT_DETAIL_LEVELS)
+        parser.add_argument("--engines", default=DEFAULT_ENGINES)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--output",
+            help="Write the results as JSON to this path.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Baseline JSON from a previous run; fails on regressions.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative slowdown/memory growth before failing.",
+        )
+
+    def handle(self, *args, **options):
+        resolutions = [parse_resolution(r) for r in options["resolutions"].split(",")]
+        detail_levels = [int(level) for level in options["detail_levels"].split(",")]
+        engines = options["engines"].split(",")
+        for engine in engines:
+            if engine not in local_converter.ENGINES:
+                raise CommandError(f"Unknown engine '{engine}'")
+
+        context = multiprocessing.get_context("spawn")
+        results = {
+            "meta": {
+                "created_at": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "repeat": options["repeat"],
+                "idle_rss_mb": self.run_in_process(context, idle_rss),
+            },
+            "cases": [],
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for width, height in resolutions:
+                image_path = os.path.join(temp_dir, f"synthetic_{width}x{height}.jpg")
+                cv2.imwrite(image_path, synthetic_image(width, height))
+
+                for engine in engines:
+                    for detail_level in detail_levels:
+                        case = {
+                            "resolution": f"{width}x{height}",
+                            "megapixels": round(width * height / 1_000_000, 2),
+                            "input_bytes": os.path.getsize(image_path),
+                            "detail_level": detail_level,
+                            "engine": engine,
+                        }
+                        case.update(
+                            self.run_in_process(
+                                context,
+                                run_case,
+                                image_path,
+                                detail_level,
+                                engine,
+                                options["repeat"],
+                            )
+                        )
+                        results["cases"].append(case)
+                        self.stdout.write(
+                            f"{case['resolution']:>10} {engine:>5} "
+                            f"detail={detail_level:<4} "
+                            f"{case['wall_time_ms']:>9.1f} ms "
+                            f"{case['peak_rss_mb']:>7.1f} MB "
+                            f"{case['output_bytes']:>10} bytes"
+                        )
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f"Results saved to {options['output']}")
+            )
+
+        if options["compare"]:
+            self.compare(results, options["compare"], options["tolerance"])
+
+    def run_in_process(self, context, target, *args):
+        queue = context.Queue()
+        process = context.Process(target=target, args=(*args, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        return result
+
+    def compare(self, results: dict, baseline_path: str, tolerance: float):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+        def case_key(case):
+            return case["resolution"], case["engine"], case["detail_level"]
+
+        baseline_cases = {case_key(case): case for case in baseline["cases"]}
+        regressions = []
+
+        for case in results["cases"]:
+            previous = baseline_cases.get(case_key(case))
+            if not previous:
+                continue
+
+            for metric in ("wall_time_ms", "peak_rss_mb"):
+                limit = previous[metric] * (1 + tolerance)
+                if case[metric] > limit:
+                    regressions.append(
+                        f"{case['resolution']} {case['engine']} "
+                        f"detail={case['detail_level']}: {metric} "
+                        f"{previous[metric]} -> {case[metric]}"
+                    )
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f"{len(regressions)} performance regression(s) found")
+
+        self.stdout.write(self.style.SUCCESS("No performance regressions found"))
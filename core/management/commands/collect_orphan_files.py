@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.services import storage_gc
+
+
+class Command(BaseCommand):
+    help = "Delete files in the image storage that no image references (also run daily by celery beat)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted",
+        )
+        parser.add_argument(
+            "--grace-seconds",
+            type=int,
+            default=None,
+            help="Keep unreferenced files newer than this (default: STORAGE_GC_GRACE_SECONDS)",
+        )
+
+    def handle(self, *args, **options):
+        report = storage_gc.collect(
+            grace_seconds=options["grace_seconds"],
+            dry_run=options["dry_run"],
+        )
+        self.stdout.write(self.style.SUCCESS(json.dumps(report, indent=2)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.models import UploadedImage
+from core.tasks import generate_thumbnails_task
+
+
+class Command(BaseCommand):
+    help = "Enqueue thumbnail generation for images that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Regenerate thumbnails for every image (e.g. after changing THUMBNAIL_WIDTHS)",
+        )
+
+    def handle(self, *args, **options):
+        images = UploadedImage.objects.exclude(image="")
+        if not options["all"]:
+            images = images.filter(thumbnails={})
+
+        count = 0
+        for image_id in images.values_list("id", flat=True).iterator():
+            generate_thumbnails_task.delay(image_id)  # type: ignore
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"{count} thumbnail tasks enqueued"))
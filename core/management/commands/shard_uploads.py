@@ -0,0 +1,120 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import storage as content_storage
+from core.models import ImageBlob, UploadedImage
+from core.services import image_blobs
+from core.services.thumbnails import thumbnail_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move uploaded images and their thumbnails from the flat uploads/ "
+        "directory to the content-addressed layout (uploads/ab/cd/<sha256>.<ext>)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of distinct files moved per batch",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be moved",
+        )
+
+    def handle(self, *args, **options):
+        self.storage = UploadedImage._meta.get_field("image").storage
+        self.dry_run = options["dry_run"]
+        self.stats = {"moved": 0, "duplicates": 0, "missing": 0, "rows": 0}
+
+        # Percorre os nomes distintos em ordem (keyset): várias linhas podem
+        # apontar para o mesmo arquivo (cache de conversão)
+        last_name = ""
+        while True:
+            names = list(
+                UploadedImage.objects.exclude(image="")
+                .filter(image__gt=last_name)
+                .order_by("image")
+                .values_list("image", flat=True)
+                .distinct()[: options["batch_size"]]
+            )
+            if not names:
+                break
+            last_name = names[-1]
+            self.move_batch(
+                [name for name in names if not content_storage.is_hashed_name(name)]
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{moved} files moved, {duplicates} duplicates merged, "
+                "{missing} missing, {rows} rows updated".format(**self.stats)
+            )
+        )
+
+    def move_batch(self, names: list[str]):
+        new_names = {}
+        for name in names:
+            if not self.storage.exists(name):
+                self.stats["missing"] += 1
+                continue
+            with self.storage.open(name) as file:
+                digest = content_storage.file_hash(file)
+            new_names[name] = content_storage.hashed_name(name, digest)
+            self.move(name, new_names[name])
+
+        images = UploadedImage.objects.filter(image__in=new_names).only(
+            "id", "image", "thumbnails"
+        )
+        updated = []
+        for image in images:
+            new_name = new_names[image.image.name]
+            thumbnails = {}
+            for width, thumbnail in image.thumbnails.items():
+                new_thumbnail = thumbnail_name(new_name, int(width))
+                self.move(thumbnail, new_thumbnail, count=False)
+                if self.dry_run or self.storage.exists(new_thumbnail):
+                    thumbnails[width] = new_thumbnail
+
+            image.image.name = new_name
+            image.thumbnails = thumbnails
+            updated.append(image)
+
+        self.stats["rows"] += len(updated)
+        if not self.dry_run:
+            with transaction.atomic():
+                UploadedImage.objects.bulk_update(updated, ["image", "thumbnails"])
+                # As referências passam para o nome novo (que pode já existir)
+                ImageBlob.objects.filter(name__in=new_names).delete()
+                image_blobs.acquire(image.image.name for image in updated)
+                for image in updated:
+                    image_blobs.set_thumbnails(
+                        image.image.name, image.thumbnails.values()
+                    )
+
+    def move(self, old_name: str, new_name: str, count: bool = True):
+        if self.dry_run:
+            self.stats["moved"] += count
+            return
+
+        old_path = self.storage.path(old_name)
+        new_path = self.storage.path(new_name)
+        if not os.path.exists(old_path):
+            # Já movido por outra linha com o mesmo arquivo
+            return
+
+        if os.path.exists(new_path):
+            # Mesmo conteúdo já está no layout novo
+            os.remove(old_path)
+            self.stats["duplicates"] += count
+            return
+
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+        self.stats["moved"] += count
@@ -0,0 +1,154 @@
+# Métricas Prometheus da aplicação web (view /metrics) e dos workers do
+# Celery (exportador HTTP iniciado no worker_init).
+#
+# Com vários processos (uvicorn --workers, pool prefork do Celery) defina
+# PROMETHEUS_MULTIPROC_DIR: cada processo grava as métricas nesse diretório
+# e quem serve o /metrics agrega todos eles.
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Chamadas aos provedores levam de poucos segundos a mais de um minuto
+SLOW_BUCKETS = (0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+
+CONVERTER_DURATION = Histogram(
+    "mydraws_converter_duration_seconds",
+    "Local sketch conversion time (local_converter.converter)",
+    ["engine", "size"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+AI_PROVIDER_LATENCY = Histogram(
+    "mydraws_ai_provider_latency_seconds",
+    "AI provider call latency",
+    ["provider", "outcome"],
+    buckets=SLOW_BUCKETS,
+)
+AI_PROVIDER_ERRORS = Counter(
+    "mydraws_ai_provider_errors_total",
+    "Failed AI provider calls",
+    ["provider", "kind"],
+)
+TASK_QUEUE_WAIT = Histogram(
+    "mydraws_task_queue_wait_seconds",
+    "Time between publishing a Celery task and a worker starting it",
+    ["task", "queue"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+TASK_RUNTIME = Histogram(
+    "mydraws_task_runtime_seconds",
+    "Celery task run time",
+    ["task", "state"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+CREDITS_DEBITED = Counter(
+    "mydraws_credits_debited_total",
+    "Credits debited from profiles",
+    ["origin"],
+)
+WEBHOOK_DURATION = Histogram(
+    "mydraws_webhook_duration_seconds",
+    "Payment webhook processing time",
+    ["provider"],
+)
+
+# Limites (em megapixels) das faixas de tamanho do CONVERTER_DURATION
+SIZE_BUCKETS = (1, 4, 16, 64)
+
+_task_started_at: dict = {}
+
+
+def size_label(width: int, height: int) -> str:
+    megapixels = width * height / 1_000_000
+    lower = 0
+    for upper in SIZE_BUCKETS:
+        if megapixels < upper:
+            return f"{lower}-{upper}MP"
+        lower = upper
+    return f"{lower}MP+"
+
+
+@contextmanager
+def converter_timer(image_path: str, engine: str):
+    from core.services import local_converter
+
+    width, height = local_converter.image_size(image_path)
+    with CONVERTER_DURATION.labels(engine, size_label(width, height)).time():
+        yield
+
+
+def provider_called(
+    provider: str,
+    latency: float,
+    error: Optional[Exception] = None,
+):
+    from core.services.ai_router import is_rate_limit_error
+
+    if error is None:
+        AI_PROVIDER_LATENCY.labels(provider, "success").observe(latency)
+        return
+
+    kind = "rate_limited" if is_rate_limit_error(error) else "error"
+    AI_PROVIDER_LATENCY.labels(provider, kind).observe(latency)
+    AI_PROVIDER_ERRORS.labels(provider, kind).inc()
+
+
+def task_published(headers: dict):
+    # Vai na mensagem para medir a espera na fila quando a task começar
+    headers["published_at"] = time.time()
+
+
+def task_started(task):
+    published_at = getattr(task.request, "published_at", None)
+    if published_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or ""
+        TASK_QUEUE_WAIT.labels(task.name, queue).observe(
+            max(0.0, time.time() - published_at)
+        )
+    _task_started_at[task.request.id] = time.monotonic()
+
+
+def task_finished(task, task_id: str, state: Optional[str]):
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        TASK_RUNTIME.labels(task.name, state or "UNKNOWN").observe(
+            time.monotonic() - started_at
+        )
+
+
+def registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def latest() -> tuple[bytes, str]:
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int):
+    # Exportador HTTP dos workers do Celery (no processo principal)
+    start_http_server(port, registry=registry())
+
+
+def process_exited(pid: int):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_conversioncache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadedimage",
+            name="task_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="uploadedimage",
+            name="task_result",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="uploadedimage",
+            name="task_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("PENDING", "Pending"), ("DONE", "Done"), ("ERROR", "Error")],
+                max_length=16,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_uploadedimage_task_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadedimage",
+            name="thumbnails",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:36
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_uploadedimage_thumbnails"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="uploadedimage",
+            name="image",
+            field=models.ImageField(
+                storage=core.storage.ContentAddressedStorage(),
+                upload_to=core.models.upload_to,
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def count_references(apps, schema_editor):
+    ImageBlob = apps.get_model("core", "ImageBlob")
+    UploadedImage = apps.get_model("core", "UploadedImage")
+
+    references = (
+        UploadedImage.objects.exclude(image="")
+        .values("image")
+        .annotate(ref_count=Count("id"))
+        .order_by("image")
+    )
+    blobs = []
+    for reference in references.iterator():
+        blobs.append(
+            ImageBlob(name=reference["image"], ref_count=reference["ref_count"])
+        )
+        if len(blobs) >= BATCH_SIZE:
+            ImageBlob.objects.bulk_create(blobs)
+            blobs = []
+    ImageBlob.objects.bulk_create(blobs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_alter_uploadedimage_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def record_thumbnails(apps, schema_editor):
+    BlobThumbnail = apps.get_model("core", "BlobThumbnail")
+    ImageBlob = apps.get_model("core", "ImageBlob")
+    UploadedImage = apps.get_model("core", "UploadedImage")
+
+    def create(batch):
+        blob_ids = dict(
+            ImageBlob.objects.filter(name__in=[name for name, _ in batch]).values_list(
+                "name", "id"
+            )
+        )
+        BlobThumbnail.objects.bulk_create(
+            [
+                BlobThumbnail(blob_id=blob_ids[name], name=thumbnail)
+                for name, thumbnails in batch
+                if name in blob_ids
+                for thumbnail in thumbnails.values()
+            ],
+            ignore_conflicts=True,
+        )
+
+    images = (
+        UploadedImage.objects.exclude(image="")
+        .exclude(thumbnails={})
+        .values_list("image", "thumbnails")
+    )
+    batch = []
+    for image in images.iterator():
+        batch.append(image)
+        if len(batch) >= BATCH_SIZE:
+            create(batch)
+            batch = []
+    create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_imageblob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlobThumbnail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(db_index=True, max_length=255)),
+                (
+                    "blob",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="thumbnails",
+                        to="core.imageblob",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("blob", "name"), name="unique_blob_thumbnail"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(record_thumbnails, migrations.RunPython.noop),
+    ]
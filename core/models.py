@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from core.storage import ContentAddressedStorage
+
 
 class Country(models.Model):
     name = models.CharField(max_length=100)
@@ -150,12 +152,20 @@ class Book(models.Model):
 
 
 def upload_to(instance, filename):
+    # O ContentAddressedStorage troca o nome pelo hash do conteúdo:
+    # uploads/ab/cd/<sha256>.<ext>
     return f"uploads/{filename}"
 
 
+class TaskStatus(models.TextChoices):
+    PENDING = "PENDING", "Pending"
+    DONE = "DONE", "Done"
+    ERROR = "ERROR", "Error"
+
+
 class UploadedImage(models.Model):
     title = models.CharField(max_length=255)
-    image = models.ImageField(upload_to=upload_to)
+    image = models.ImageField(upload_to=upload_to, storage=ContentAddressedStorage())
     created_at = models.DateTimeField(auto_now_add=True)
     default = models.BooleanField(default=False)
     based_on = models.ForeignKey(
@@ -179,6 +189,97 @@ class UploadedImage(models.Model):
         null=True,
         blank=True,
     )
+    # Última task de conversão disparada a partir desta imagem
+    task_id = models.CharField(max_length=255, null=True, blank=True)
+    task_status = models.CharField(
+        max_length=16,
+        choices=TaskStatus.choices,
+        null=True,
+        blank=True,
+    )
+    task_result = models.CharField(max_length=255, null=True, blank=True)
+    # {"largura": nome no storage}, preenchido por generate_thumbnails_task
+    thumbnails = models.JSONField(default=dict, blank=True)
 
     def __str__(self) -> str:
         return f"{self.title}"
+
+    def thumbnail_url(self, width: int = 320) -> str:
+        # Menor miniatura com pelo menos ``width`` pixels; sem nenhuma
+        # (ainda não geradas ou original já pequeno), o próprio original
+        for thumbnail_width, name in self.sorted_thumbnails():
+            if thumbnail_width >= width:
+                return self.image.storage.url(name)
+        return self.image.url
+
+    @property
+    def srcset(self) -> str:
+        return ", ".join(
+            f"{self.image.storage.url(name)} {thumbnail_width}w"
+            for thumbnail_width, name in self.sorted_thumbnails()
+        )
+
+    def sorted_thumbnails(self) -> list[tuple[int, str]]:
+        return sorted((int(width), name) for width, name in self.thumbnails.items())
+
+    def start_task(self, task_id: str):
+        self.task_id = task_id
+        self.task_status = TaskStatus.PENDING
+        self.task_result = None
+        self.save(update_fields=["task_id", "task_status", "task_result"])
+
+    @property
+    def has_pending_task(self) -> bool:
+        return self.task_status == TaskStatus.PENDING
+
+
+class ImageBlob(models.Model):
+    # Arquivo no storage endereçado por conteúdo, compartilhado por todas as
+    # UploadedImage com os mesmos bytes. O arquivo (e as miniaturas) só é
+    # apagado quando a última referência é removida.
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.ref_count})"
+
+
+class BlobThumbnail(models.Model):
+    # Miniatura de um ImageBlob, indexada pelo nome para a coleta de órfãos
+    # (storage_gc): miniaturas de imagens fora do layout novo têm nome de
+    # hash qualquer. Some junto com o blob.
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.CASCADE,
+        related_name="thumbnails",
+    )
+    name = models.CharField(max_length=255, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.name}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["blob", "name"], name="unique_blob_thumbnail"
+            ),
+        ]
+
+
+class ConversionCache(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    image = models.ForeignKey(
+        UploadedImage,
+        on_delete=models.CASCADE,
+        related_name="cache_entries",
+    )
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.key[:12]} -> {self.image}"
+
+    class Meta:
+        verbose_name_plural = "Conversion Cache"
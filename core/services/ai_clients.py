@@ -0,0 +1,103 @@
+# Um cliente por provedor de IA por processo, compartilhando as conexões
+# keep-alive entre as tasks. Criados no worker_process_init do Celery
+# (bobbies_creator/celery.py) ou, fora do Celery, no primeiro uso.
+
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from decouple import UndefinedValueError, config
+from google import genai
+from google.genai import types
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+_lock = threading.Lock()
+_openai_client: Optional[OpenAI] = None
+_genai_client: Optional[genai.Client] = None
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config("AI_HTTP_MAX_CONNECTIONS", default=20, cast=int),
+        max_keepalive_connections=config(
+            "AI_HTTP_MAX_KEEPALIVE_CONNECTIONS", default=10, cast=int
+        ),
+        keepalive_expiry=config("AI_HTTP_KEEPALIVE_EXPIRY", default=120, cast=float),
+    )
+
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=config("OPENAI_API_KEY"),  # type: ignore
+                    organization=config("OPENAI_ORG_ID"),  # type: ignore
+                    http_client=DefaultHttpxClient(limits=http_limits()),
+                )
+    return _openai_client
+
+
+def get_genai_client() -> genai.Client:
+    global _genai_client
+    if _genai_client is None:
+        with _lock:
+            if _genai_client is None:
+                _genai_client = genai.Client(
+                    api_key=config("GENAI_API_KEY"),  # type: ignore
+                    http_options=types.HttpOptions(
+                        client_args={"limits": http_limits()},
+                        async_client_args={"limits": http_limits()},
+                    ),
+                )
+    return _genai_client
+
+
+def init_clients():
+    # Provedores sem chave configurada são ignorados aqui e só falham se
+    # forem realmente usados
+    for get_client in (get_openai_client, get_genai_client):
+        try:
+            get_client()
+        except UndefinedValueError:
+            pass
+
+
+def close_clients():
+    global _openai_client, _genai_client
+    with _lock:
+        if _openai_client is not None:
+            _openai_client.close()
+        _openai_client = None
+        _genai_client = None
+
+
+@asynccontextmanager
+async def async_clients():
+    # Clientes assíncronos ficam presos ao event loop que os criou, então
+    # cada execução em lote (asyncio.run) abre e fecha os seus.
+    # Retorna {nome do provedor: cliente}, sem os provedores sem chave.
+    clients = {}
+    try:
+        clients["openai"] = AsyncOpenAI(
+            api_key=config("OPENAI_API_KEY"),  # type: ignore
+            organization=config("OPENAI_ORG_ID"),  # type: ignore
+            http_client=DefaultAsyncHttpxClient(limits=http_limits()),
+        )
+    except UndefinedValueError:
+        pass
+    try:
+        clients["gemini"] = genai.Client(
+            api_key=config("GENAI_API_KEY"),  # type: ignore
+            http_options=types.HttpOptions(async_client_args={"limits": http_limits()}),
+        )
+    except UndefinedValueError:
+        pass
+
+    try:
+        yield clients
+    finally:
+        if "openai" in clients:
+            await clients["openai"].close()
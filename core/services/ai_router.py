@@ -0,0 +1,384 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+from django.conf import settings
+
+from core import metrics
+from core.services.design_by_ai import DesignByAI
+from core.services.design_by_openai import DesignByOpenAI
+from core.services.rate_limiter import RateLimiter, get_rate_limiter
+
+
+class AIGenerationError(Exception):
+    pass
+
+
+class AIRateLimited(AIGenerationError):
+    """
+    Nenhum provedor tem orçamento agora; tente de novo em ``retry_after``.
+    """
+
+    def __init__(self, retry_after: float, errors: Optional[list] = None):
+        super().__init__(f"AI providers rate limited, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.errors = errors or []
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    # openai.RateLimitError tem status_code, google.genai.errors.APIError tem code
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+
+class AIProvider:
+    """
+    Interface comum dos provedores de geração por IA.
+    """
+
+    name = ""
+
+    def generate(self, image_path: str) -> bytes:
+        raise NotImplementedError
+
+    async def agenerate(self, image_path: str, client) -> bytes:
+        raise NotImplementedError
+
+    def output_filename(self, image_path: str) -> str:
+        raise NotImplementedError
+
+    def cache_params(self, image_path: str) -> dict:
+        # Tudo que muda o resultado além da imagem de entrada
+        raise NotImplementedError
+
+
+class OpenAIProvider(AIProvider):
+    name = "openai"
+
+    def generate(self, image_path: str) -> bytes:
+        return DesignByOpenAI(image_path=image_path).generate()
+
+    async def agenerate(self, image_path: str, client) -> bytes:
+        designer = DesignByOpenAI(image_path=image_path, client=client)
+        return await designer.agenerate(client)
+
+    def output_filename(self, image_path: str) -> str:
+        return DesignByOpenAI.filename_for(image_path)
+
+    def cache_params(self, image_path: str) -> dict:
+        return {
+            "provider": self.name,
+            "model": DesignByOpenAI.DEFAULT_MODEL,
+            "prompt": DesignByOpenAI.DEFAULT_PROMPT,
+            "size": DesignByOpenAI.SIZE,
+            "input": (DesignByOpenAI.INPUT_MODE, DesignByOpenAI.INPUT_SIZE),
+        }
+
+
+class GeminiProvider(AIProvider):
+    name = "gemini"
+
+    def generate(self, image_path: str) -> bytes:
+        image_bytes = DesignByAI(image_path=image_path).generate_from_gemini()
+        if not image_bytes:
+            raise AIGenerationError("Gemini did not return an image")
+        return image_bytes
+
+    async def agenerate(self, image_path: str, client) -> bytes:
+        designer = DesignByAI(image_path=image_path, client=client)
+        image_bytes = await designer.agenerate_from_gemini(client)
+        if not image_bytes:
+            raise AIGenerationError("Gemini did not return an image")
+        return image_bytes
+
+    def output_filename(self, image_path: str) -> str:
+        return DesignByAI.filename_for(image_path)
+
+    def cache_params(self, image_path: str) -> dict:
+        return {
+            "provider": self.name,
+            "model": DesignByAI.DEFAULT_MODEL,
+            "prompt": DesignByAI.DEFAULT_PROMPT,
+            "input": (DesignByAI.INPUT_MODE, DesignByAI.INPUT_SIZE),
+        }
+
+
+PROVIDERS = {
+    OpenAIProvider.name: OpenAIProvider,
+    GeminiProvider.name: GeminiProvider,
+}
+
+
+class ProviderStats:
+    """
+    Janela móvel das últimas chamadas de um provedor (latência e sucesso).
+    """
+
+    def __init__(self, window: int):
+        self.calls: deque = deque(maxlen=window)
+        self.last_failure_at = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, success: bool):
+        with self.lock:
+            self.calls.append((latency, success))
+            if not success:
+                self.last_failure_at = time.monotonic()
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self.lock:
+            latencies = sorted(latency for latency, success in self.calls if success)
+        if not latencies:
+            return None
+        index = min(int(len(latencies) * percent / 100), len(latencies) - 1)
+        return latencies[index]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(50)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(95)
+
+    @property
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.calls:
+                return 0.0
+            return sum(1 for _, success in self.calls if not success) / len(self.calls)
+
+
+class AIRouter:
+    """
+    Escolhe o provedor mais rápido (p50) entre os saudáveis e faz failover
+    para o próximo quando a chamada falha.
+
+    Com ``limiter`` configurado, cada chamada reserva antes um token do
+    provedor; provedores sem orçamento são pulados e, se nenhum tiver,
+    ``AIRateLimited`` informa quanto esperar.
+
+    Um provedor fica fora de rotação quando a taxa de erro da janela passa
+    de ``max_error_rate``; depois de ``cooldown`` segundos sem falhas ele
+    volta a receber tráfego. Com ``hedge_after`` definido, uma segunda
+    chamada é disparada no próximo provedor se a primeira não responder
+    nesse tempo, e vale a que terminar primeiro.
+    """
+
+    def __init__(
+        self,
+        providers: list[AIProvider],
+        window: int = 50,
+        max_error_rate: float = 0.5,
+        cooldown: float = 120.0,
+        hedge_after: Optional[float] = None,
+        limiter: Optional[RateLimiter] = None,
+        rate_limit_retry_after: float = 20.0,
+    ):
+        self.providers = providers
+        self.stats = {provider.name: ProviderStats(window) for provider in providers}
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.limiter = limiter
+        # Espera sugerida quando o próprio provedor responde 429
+        self.rate_limit_retry_after = rate_limit_retry_after
+
+    def is_healthy(self, provider: AIProvider) -> bool:
+        stats = self.stats[provider.name]
+        if stats.error_rate <= self.max_error_rate:
+            return True
+        return time.monotonic() - stats.last_failure_at > self.cooldown
+
+    def ranked(self) -> list[AIProvider]:
+        # Saudáveis primeiro, ordenados pelo p50; provedores ainda sem
+        # medições mantêm a ordem configurada e vêm antes dos medidos
+        def sort_key(item):
+            position, provider = item
+            p50 = self.stats[provider.name].p50
+            return (
+                not self.is_healthy(provider),
+                p50 is not None,
+                p50 or 0.0,
+                position,
+            )
+
+        return [
+            provider for _, provider in sorted(enumerate(self.providers), key=sort_key)
+        ]
+
+    def reserve(self, provider: AIProvider) -> float:
+        # Segundos até o provedor ter orçamento (0 = pode chamar agora)
+        if self.limiter is None:
+            return 0.0
+        return self.limiter.acquire(provider.name)
+
+    def record(
+        self,
+        provider: AIProvider,
+        latency: float,
+        error: Optional[Exception] = None,
+    ):
+        self.stats[provider.name].record(latency, error is None)
+        metrics.provider_called(provider.name, latency, error)
+
+    def call(self, provider: AIProvider, image_path: str) -> bytes:
+        start = time.monotonic()
+        try:
+            image_bytes = provider.generate(image_path)
+        except Exception as error:
+            self.record(provider, time.monotonic() - start, error)
+            raise
+        self.record(provider, time.monotonic() - start)
+        return image_bytes
+
+    def generate(self, image_path: str) -> tuple[AIProvider, bytes]:
+        providers = self.ranked()
+        errors: list = []
+        waits: list = []
+
+        if self.hedge_after and len(providers) > 1:
+            result, providers = self.generate_first_hedged(
+                providers, image_path, errors, waits
+            )
+            if result:
+                return result
+
+        for provider in providers:
+            wait = self.reserve(provider)
+            if wait:
+                waits.append(wait)
+                continue
+            try:
+                return provider, self.call(provider, image_path)
+            except Exception as error:
+                errors.append(error)
+
+        if any(is_rate_limit_error(error) for error in errors):
+            waits.append(self.rate_limit_retry_after)
+        if waits:
+            raise AIRateLimited(min(waits), errors)
+        raise AIGenerationError(f"All AI providers failed: {errors}")
+
+    def generate_first_hedged(
+        self,
+        providers: list[AIProvider],
+        image_path: str,
+        errors: list,
+        waits: list,
+    ) -> tuple[Optional[tuple[AIProvider, bytes]], list[AIProvider]]:
+        # Os dois primeiros com hedge. Retorna o resultado ou os provedores
+        # que ainda não foram tentados nem estão esperando orçamento
+        wait = self.reserve(providers[0])
+        if wait:
+            waits.append(wait)
+            return None, providers[1:]
+
+        try:
+            result = self.generate_hedged(
+                providers[0], providers[1], image_path, errors, waits
+            )
+        except AIGenerationError:
+            return None, providers[2:]
+        return result, []
+
+    async def agenerate(
+        self, image_path: str, clients: dict
+    ) -> tuple[AIProvider, bytes]:
+        # Versão assíncrona para o modo em lote; clients vem de
+        # ai_clients.async_clients(). Sem hedge: a concorrência já vem das
+        # várias páginas em paralelo. Sem orçamento em nenhum provedor, a
+        # chamada espera aqui mesmo pelo próximo token. Só desiste quando
+        # todos os provedores falharam.
+        errors: list = []
+        failed = set()
+        while True:
+            waits = []
+            for provider in self.ranked():
+                if provider.name not in clients or provider.name in failed:
+                    continue
+                wait = await asyncio.to_thread(self.reserve, provider)
+                if wait:
+                    waits.append(wait)
+                    continue
+
+                start = time.monotonic()
+                try:
+                    image_bytes = await provider.agenerate(
+                        image_path, clients[provider.name]
+                    )
+                except Exception as error:
+                    self.record(provider, time.monotonic() - start, error)
+                    errors.append(error)
+                    failed.add(provider.name)
+                    continue
+                self.record(provider, time.monotonic() - start)
+                return provider, image_bytes
+
+            if not waits:
+                break
+            await asyncio.sleep(min(waits))
+
+        if any(is_rate_limit_error(error) for error in errors):
+            raise AIRateLimited(self.rate_limit_retry_after, errors)
+        raise AIGenerationError(f"All AI providers failed: {errors}")
+
+    def generate_hedged(
+        self,
+        primary: AIProvider,
+        secondary: AIProvider,
+        image_path: str,
+        errors: Optional[list] = None,
+        waits: Optional[list] = None,
+    ) -> tuple[AIProvider, bytes]:
+        # O token do primário já foi reservado por quem chamou. Sem
+        # orçamento no secundário, a espera dele vai para ``waits``.
+        errors = [] if errors is None else errors
+        waits = [] if waits is None else waits
+        executor = ThreadPoolExecutor(max_workers=2)
+        futures = {executor.submit(self.call, primary, image_path): primary}
+
+        try:
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done or next(iter(done)).exception():
+                secondary_wait = self.reserve(secondary)
+                if secondary_wait:
+                    waits.append(secondary_wait)
+                else:
+                    future = executor.submit(self.call, secondary, image_path)
+                    futures[future] = secondary
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return futures[future], future.result()
+                    errors.append(future.exception())
+
+            raise AIGenerationError(f"Hedged AI providers failed: {errors}")
+        finally:
+            # A chamada perdedora termina em background e só alimenta as métricas
+            executor.shutdown(wait=False)
+
+
+_router: Optional[AIRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> AIRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = AIRouter(
+                    providers=[PROVIDERS[name]() for name in settings.AI_PROVIDERS],
+                    window=settings.AI_ROUTER_WINDOW,
+                    max_error_rate=settings.AI_ROUTER_MAX_ERROR_RATE,
+                    cooldown=settings.AI_ROUTER_COOLDOWN,
+                    hedge_after=settings.AI_HEDGE_AFTER_SECONDS or None,
+                    limiter=get_rate_limiter(),
+                )
+    return _router
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from core import storage
+from core.models import ConversionCache, UploadedImage
+
+logger = logging.getLogger(__name__)
+
+_lock_client: Optional[redis.Redis] = None
+_lock_client_lock = threading.Lock()
+
+
+def content_hash(file) -> str:
+    # No layout endereçado por conteúdo o hash já está no nome do arquivo
+    digest = storage.name_hash(file.name)
+    if digest:
+        return digest
+
+    sha256 = hashlib.sha256()
+    file.open("rb")
+    try:
+        for chunk in file.chunks():
+            sha256.update(chunk)
+    finally:
+        file.close()
+    return sha256.hexdigest()
+
+
+def make_key(source_hash: str, **params) -> str:
+    payload = json.dumps({"source": source_hash, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(key: str, max_age: Optional[int] = None) -> Optional[UploadedImage]:
+    entry = ConversionCache.objects.select_related("image").filter(key=key).first()
+    if not entry:
+        return None
+
+    if max_age and entry.created_at < timezone.now() - timedelta(seconds=max_age):
+        entry.delete()
+        return None
+
+    # Atualiza o last_used_at (auto_now) para a política de LRU
+    entry.hits = F("hits") + 1
+    entry.save(update_fields=["hits", "last_used_at"])
+    return entry.image
+
+
+def store(key: str, image: UploadedImage):
+    ConversionCache.objects.update_or_create(key=key, defaults={"image": image})
+    evict()
+
+
+def evict(max_entries: Optional[int] = None):
+    # LRU: mantém apenas as entradas usadas mais recentemente
+    if max_entries is None:
+        max_entries = settings.CONVERSION_CACHE_MAX_ENTRIES
+
+    stale_ids = ConversionCache.objects.order_by("-last_used_at").values_list(
+        "id", flat=True
+    )[max_entries:]
+    ConversionCache.objects.filter(id__in=list(stale_ids)).delete()
+
+
+def get_lock_client() -> Optional[redis.Redis]:
+    global _lock_client
+    url = settings.CONVERSION_LOCK_REDIS_URL
+    if not url.startswith(("redis://", "rediss://")):
+        return None
+
+    if _lock_client is None:
+        with _lock_client_lock:
+            if _lock_client is None:
+                _lock_client = redis.Redis.from_url(url)
+    return _lock_client
+
+
+@contextmanager
+def conversion_lock(key: str):
+    """
+    Lock entre todos os workers para a chave de cache ``key``: a segunda
+    conversão espera a primeira terminar e então a encontra no cache.
+    Sem Redis (ou com Redis fora do ar) segue sem lock.
+    """
+    client = get_lock_client()
+    if client is None:
+        yield
+        return
+
+    lock = client.lock(
+        f"conversion_lock:{key}",
+        timeout=settings.CONVERSION_LOCK_TIMEOUT,
+        blocking_timeout=settings.CONVERSION_LOCK_TIMEOUT,
+    )
+    try:
+        acquired = lock.acquire()
+    except redis.RedisError as error:
+        logger.warning("Could not acquire conversion lock: %s", error)
+        acquired = False
+
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.RedisError as error:
+                # Expirou (conversão mais longa que o timeout) ou Redis fora
+                logger.warning("Could not release conversion lock: %s", error)
@@ -0,0 +1,126 @@
+# Contagem de referências dos arquivos de imagem. Com o storage endereçado
+# por conteúdo, várias UploadedImage apontam para o mesmo arquivo; o
+# ImageBlob conta essas linhas e o arquivo só é removido na última.
+#
+# post_save/post_delete (core/signals.py) mantêm a contagem; quem usa
+# bulk_create chama acquire() diretamente.
+
+import logging
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from core.models import BlobThumbnail, ImageBlob, UploadedImage
+from core.services.thumbnails import thumbnail_name
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(names: Iterable[str]):
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+
+    # Uma query por quantidade distinta, não uma por arquivo
+    names_by_count = defaultdict(list)
+    for name, count in counts.items():
+        names_by_count[count].append(name)
+
+    with transaction.atomic():
+        # Trava as linhas até o incremento: um release concorrente não pode
+        # apagar o blob (e agendar a remoção do arquivo) no meio. Linhas
+        # apagadas antes da trava são recriadas na volta seguinte.
+        while True:
+            ImageBlob.objects.bulk_create(
+                [ImageBlob(name=name) for name in counts],
+                ignore_conflicts=True,
+            )
+            locked = (
+                ImageBlob.objects.select_for_update()
+                .filter(name__in=counts)
+                .order_by("name")
+                .values_list("name", flat=True)
+            )
+            if len(locked) == len(counts):
+                break
+
+        for count, blob_names in names_by_count.items():
+            ImageBlob.objects.filter(name__in=blob_names).update(
+                ref_count=F("ref_count") + count
+            )
+
+
+def release(name: str, thumbnail_names: Iterable[str] = ()):
+    if not name:
+        return
+
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+        if not blob:
+            return
+        if blob.ref_count > 1:
+            ImageBlob.objects.filter(id=blob.id).update(ref_count=F("ref_count") - 1)
+            return
+        # A linha fica com ref_count 0 até delete_files: é ela que o save do
+        # mesmo conteúdo trava para cancelar a remoção
+        ImageBlob.objects.filter(id=blob.id).update(ref_count=0)
+
+    thumbnail_names = list(thumbnail_names)
+    transaction.on_commit(lambda: delete_files(name, thumbnail_names))
+
+
+def set_thumbnails(name: str, thumbnail_names: Iterable[str]):
+    # Registra as miniaturas do blob (substituindo as anteriores) para a
+    # coleta de órfãos (storage_gc) achá-las pelo nome
+    blob = ImageBlob.objects.filter(name=name).first()
+    if not blob:
+        return
+
+    thumbnail_names = set(thumbnail_names)
+    with transaction.atomic():
+        blob.thumbnails.exclude(name__in=thumbnail_names).delete()  # type: ignore
+        BlobThumbnail.objects.bulk_create(
+            [BlobThumbnail(blob=blob, name=thumbnail) for thumbnail in thumbnail_names],
+            ignore_conflicts=True,
+        )
+
+
+def cancel_pending_delete(name: str):
+    # Chamado pelo ContentAddressedStorage.save antes de reaproveitar ou gravar
+    # o arquivo. Apagar a linha pendente (ref_count 0) espera o delete_files
+    # em andamento terminar e impede o próximo; o acquire recria a linha.
+    ImageBlob.objects.filter(name=name, ref_count=0).delete()
+
+
+def delete_files(name: str, thumbnail_names: Iterable[str] = ()):
+    storage = UploadedImage._meta.get_field("image").storage
+
+    with transaction.atomic():
+        # Sem a linha pendente o mesmo conteúdo foi enviado de novo desde o
+        # commit (acquire ou cancel_pending_delete)
+        blob = (
+            ImageBlob.objects.select_for_update().filter(name=name, ref_count=0).first()
+        )
+        if not blob:
+            return
+
+        names = {name, *thumbnail_names}
+        names.update(thumbnail_name(name, width) for width in settings.THUMBNAIL_WIDTHS)
+        # Miniatura idêntica à de outro blob (mesmo nome de hash) continua em uso
+        names -= set(
+            BlobThumbnail.objects.filter(name__in=names)
+            .exclude(blob=blob)
+            .values_list("name", flat=True)
+        )
+        # Os arquivos são apagados com a linha travada: um save concorrente
+        # espera e então grava o arquivo de novo
+        for file_name in names:
+            try:
+                storage.delete(file_name)
+            except OSError as error:
+                # Fica órfão no storage até a próxima coleta (storage_gc)
+                logger.warning("Could not delete %s: %s", file_name, error)
+        blob.delete()
@@ -0,0 +1,98 @@
+# Preparação comum da imagem antes do envio aos provedores de IA: reduz
+# para a resolução de trabalho do provedor, ajusta à proporção de saída e
+# remove metadados, para enviar o mínimo de bytes possível.
+
+from io import BytesIO
+
+from PIL import ExifTags, Image, ImageOps
+
+FIT = "fit"
+PAD = "pad"
+MODES = (FIT, PAD)
+
+JPEG_QUALITY = 85
+PAD_COLOR = (255, 255, 255)
+
+# Orientações EXIF que trocam largura e altura
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def oriented_size(image: Image.Image) -> tuple[int, int]:
+    width, height = image.size
+    orientation = image.getexif().get(ExifTags.Base.Orientation)
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def contained_size(size: tuple[int, int], box: tuple[int, int]) -> tuple[int, int]:
+    # Maior tamanho com a proporção de ``size`` que cabe em ``box``, sem ampliar
+    scale = min(box[0] / size[0], box[1] / size[1], 1.0)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def prepare_image(
+    image: Image.Image,
+    size: tuple[int, int],
+    mode: str = FIT,
+    quality: int = JPEG_QUALITY,
+) -> bytes:
+    """
+    Retorna um JPEG sem metadados da imagem na resolução de trabalho.
+
+    ``fit`` mantém a proporção original dentro de ``size``; ``pad`` completa
+    com branco até a proporção exata de ``size``, para que o provedor não
+    corte nem distorça a imagem ao gerar uma saída de tamanho fixo. A imagem
+    nunca é ampliada.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown preparation mode: {mode}")
+
+    target = contained_size(oriented_size(image), size)
+
+    # JPEG: decodifica direto em escala reduzida (1/2, 1/4, 1/8)
+    draft_size = target
+    if oriented_size(image) != image.size:
+        draft_size = target[1], target[0]
+    image.draft("RGB", draft_size)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        # Fundo branco no lugar da transparência
+        background = Image.new("RGB", image.size, PAD_COLOR)
+        background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = background
+    image = image.convert("RGB")
+
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+
+    if mode == PAD:
+        # Menor tela com a proporção de ``size`` que contém a imagem
+        scale = max(target[0] / size[0], target[1] / size[1])
+        canvas = Image.new(
+            "RGB",
+            (
+                max(target[0], round(size[0] * scale)),
+                max(target[1], round(size[1] * scale)),
+            ),
+            PAD_COLOR,
+        )
+        canvas.paste(
+            image,
+            ((canvas.width - target[0]) // 2, (canvas.height - target[1]) // 2),
+        )
+        image = canvas
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_image_file(
+    image_path: str,
+    size: tuple[int, int],
+    mode: str = FIT,
+) -> bytes:
+    with Image.open(image_path) as image:
+        return prepare_image(image, size, mode)
@@ -1,35 +1,227 @@
 import os
+from typing import Optional
+
 import cv2
+import numpy as np
 from django.conf import settings
+from PIL import Image
 
+ENGINES = ("exact", "fast")
 
-def converter(
-    filename: str,
-    image_path: str,
-    detail_level: int = 21,
-) -> str:
-    base_filename = os.path.basename(filename)
-    name_no_ext = os.path.splitext(base_filename)[0]
-    sketch_filename = name_no_ext + "_sketch.jpg"
+# Sigma mínimo (em pixels do nível reduzido) para o engine "fast"
+FAST_MIN_SIGMA = 4.0
+FAST_MAX_FACTOR = 16
 
-    converted_dir = os.path.join(settings.MEDIA_ROOT, "temp")
-    if not os.path.exists(converted_dir):
-        os.makedirs(converted_dir)
+# Decodificação reduzida: o libjpeg decodifica direto em 1/2, 1/4 ou 1/8
+REDUCED_GRAYSCALE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+}
 
-    sketch_path = os.path.join(converted_dir, sketch_filename)
-    # Resto do processamento
-    original_image = cv2.imread(image_path)
-    gray_image = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY)
-    inverted_image = 255 - gray_image
 
+def normalize_detail_level(detail_level: int) -> int:
+    # GaussianBlur only accepts positive odd kernel sizes
     if detail_level < 1:
         detail_level = 1
     if detail_level % 2 == 0:
         detail_level += 1
+    return detail_level
+
+
+def gaussian_sigma(detail_level: int) -> float:
+    # Mesmo sigma que o GaussianBlur usa quando recebe sigma=0
+    return 0.3 * ((detail_level - 1) * 0.5 - 1) + 0.8
+
+
+def blur_fast(inverted_image: np.ndarray, detail_level: int) -> np.ndarray:
+    """
+    Aproximação do GaussianBlur com custo praticamente constante.
+
+    A imagem é reduzida por um fator ``f`` (potência de 2, até 16) com
+    INTER_AREA, o blur é aplicado no nível reduzido com sigma / f
+    (descontando a variância do box filter da redução) e o resultado é
+    ampliado de volta com INTER_LINEAR. O fator é o maior que mantém pelo
+    menos FAST_MIN_SIGMA pixels de sigma no nível reduzido, então níveis de
+    detalhe pequenos (sigma <= 8, detail_level até 51) continuam exatos.
+
+    Erro medido contra o GaussianBlur exato (imagens de 640x480 a 12MP,
+    detail_level de 53 a 401, ver LocalConverterFastEngineTests):
 
-    blurred_image = cv2.GaussianBlur(inverted_image, (detail_level, detail_level), 0)
+    - blur: no máximo 7 níveis de cinza, erro médio <= 0.5;
+    - sketch final: erro médio <= 0.4 e 99.9% dos pixels a no máximo 6
+      níveis; o máximo foi 13 níveis nas imagens parecidas com fotos.
+
+    Em áreas quase pretas o divide amplifica o erro (cinza e 255 - blur
+    perto de zero: 1/1 contra 1/2), então pixels isolados podem diferir
+    bem mais (até 127 níveis numa imagem de gradientes suaves).
+    """
+    sigma = gaussian_sigma(detail_level)
+    height, width = inverted_image.shape[:2]
+
+    factor = 1
+    while (
+        sigma / (factor * 2) >= FAST_MIN_SIGMA
+        and factor * 2 <= FAST_MAX_FACTOR
+        and min(height, width) // (factor * 2) >= 1
+    ):
+        factor *= 2
+
+    if factor == 1:
+        return cv2.GaussianBlur(inverted_image, (detail_level, detail_level), 0)
+
+    small_image = cv2.resize(
+        inverted_image,
+        (max(width // factor, 1), max(height // factor, 1)),
+        interpolation=cv2.INTER_AREA,
+    )
+    small_sigma = np.sqrt(max(sigma**2 - (factor**2 - 1) / 12, 0.01)) / factor
+    small_blurred = cv2.GaussianBlur(small_image, (0, 0), small_sigma)
+    return cv2.resize(small_blurred, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def sketch_from_gray(
+    gray_image: np.ndarray,
+    detail_level: int,
+    engine: str = "exact",
+) -> np.ndarray:
+    inverted_image = 255 - gray_image
+    if engine == "fast":
+        blurred_image = blur_fast(inverted_image, detail_level)
+    else:
+        blurred_image = cv2.GaussianBlur(
+            inverted_image, (detail_level, detail_level), 0
+        )
     inverted_blurred_image = 255 - blurred_image
-    sketch = cv2.divide(gray_image, inverted_blurred_image, scale=256.0)
+    return cv2.divide(gray_image, inverted_blurred_image, scale=256.0)
+
+
+def sketch_tiled(
+    original_image: np.ndarray,
+    detail_level: int,
+    tile_rows: int,
+    engine: str = "exact",
+) -> np.ndarray:
+    """
+    Processa a imagem em faixas horizontais de ``tile_rows`` linhas.
+
+    Cada faixa é lida com uma margem (halo) de ``detail_level // 2`` linhas
+    acima e abaixo, o suficiente para cobrir o kernel do GaussianBlur, então
+    as linhas úteis de cada faixa são idênticas às do processamento da
+    imagem inteira. Os intermediários (cinza, invertido, blur...) passam a
+    ter o tamanho de uma faixa em vez do tamanho da imagem.
+
+    A decodificação não é em faixas: ``original_image`` (BGR) e o sketch
+    continuam inteiros na memória. A economia é só nos intermediários, cerca
+    de 25% do pico numa foto de 48MP (277MB contra 370MB).
+    """
+    height, width = original_image.shape[:2]
+    halo = detail_level // 2
+    sketch = np.empty((height, width), dtype=np.uint8)
+
+    for top in range(0, height, tile_rows):
+        bottom = min(top + tile_rows, height)
+        halo_top = max(top - halo, 0)
+        halo_bottom = min(bottom + halo, height)
+
+        gray_strip = cv2.cvtColor(
+            original_image[halo_top:halo_bottom], cv2.COLOR_BGR2GRAY
+        )
+        sketch_strip = sketch_from_gray(gray_strip, detail_level, engine=engine)
+        sketch[top:bottom] = sketch_strip[top - halo_top : bottom - halo_top]
+
+    return sketch
+
+
+def sketch_filename(filename: str, suffix: str = "_sketch") -> str:
+    base_filename = os.path.basename(filename)
+    name_no_ext = os.path.splitext(base_filename)[0]
+    return name_no_ext + suffix + ".jpg"
+
+
+def encode_jpeg(sketch: np.ndarray) -> bytes:
+    success, buffer = cv2.imencode(".jpg", sketch)
+    if not success:
+        raise ValueError("Could not encode the sketch as JPEG")
+    return buffer.tobytes()
+
+
+def default_tile_rows(original_image: np.ndarray) -> Optional[int]:
+    # Imagens grandes são processadas em faixas: os intermediários ficam do
+    # tamanho de uma faixa (a imagem decodificada continua inteira)
+    height, width = original_image.shape[:2]
+    if height * width > settings.LOCAL_CONVERTER_TILED_MIN_PIXELS:
+        return settings.LOCAL_CONVERTER_TILE_ROWS
+    return None
+
+
+def image_size(image_path: str) -> tuple[int, int]:
+    # O PIL lê apenas o cabeçalho aqui, sem decodificar os pixels
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def read_gray(image_path: str, max_size: int) -> tuple[np.ndarray, float]:
+    """
+    Lê a imagem em cinza com o lado maior limitado a ``max_size``.
+
+    Usa o maior fator de IMREAD_REDUCED_GRAYSCALE_* que ainda deixa a imagem
+    com pelo menos ``max_size`` pixels, o que pula a decodificação completa
+    e a conversão de cor, e termina com um INTER_AREA até o tamanho pedido.
+    Retorna a imagem e a escala em relação ao original.
+    """
+    width, height = image_size(image_path)
+    longest_side = max(width, height)
+
+    for factor, flag in REDUCED_GRAYSCALE_FLAGS.items():
+        if longest_side // factor >= max_size:
+            gray_image = cv2.imread(image_path, flag)
+            break
+    else:
+        gray_image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+
+    reduced_height, reduced_width = gray_image.shape[:2]
+    scale = max_size / max(reduced_height, reduced_width)
+    if scale < 1.0:
+        gray_image = cv2.resize(
+            gray_image,
+            (
+                max(round(reduced_width * scale), 1),
+                max(round(reduced_height * scale), 1),
+            ),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    # Compara os lados maiores: o imread aplica a orientação do EXIF
+    return gray_image, max(gray_image.shape[:2]) / longest_side
+
+
+def converter(
+    image_path: str,
+    detail_level: int = 21,
+    tile_rows: Optional[int] = None,
+    engine: str = "exact",
+    max_size: Optional[int] = None,
+) -> bytes:
+    detail_level = normalize_detail_level(detail_level)
+
+    if max_size:
+        # Saída reduzida: o kernel acompanha a escala da imagem
+        gray_image, scale = read_gray(image_path, max_size)
+        detail_level = normalize_detail_level(round(detail_level * scale))
+        sketch = sketch_from_gray(gray_image, detail_level, engine=engine)
+        return encode_jpeg(sketch)
+
+    original_image = cv2.imread(image_path)
+
+    if tile_rows is None:
+        tile_rows = default_tile_rows(original_image)
+
+    if tile_rows:
+        sketch = sketch_tiled(original_image, detail_level, tile_rows, engine)
+    else:
+        gray_image = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY)
+        sketch = sketch_from_gray(gray_image, detail_level, engine=engine)
+    del original_image
 
-    cv2.imwrite(sketch_path, sketch)
-    return sketch_path
+    return encode_jpeg(sketch)
@@ -3,6 +3,7 @@ from decimal import Decimal
 from typing import Dict, Optional, Tuple
 
 from django.db import transaction
+from django.db.models import F
 from decouple import config
 
 from core.models import Profile, CreditTransaction
@@ -84,7 +85,7 @@ class MercadoPagoService:
             }
 
             preference_response = self.sdk.preference().create(preference_data)
-            
+
             if preference_response["status"] == 201:
                 logger.info(
                     "Preferência criada com sucesso para usuário %s. ID: %s",
@@ -181,8 +182,10 @@ class MercadoPagoService:
                 logger.warning("Transação já processada para pagamento %s", payment_id)
                 return False, "Transação já processada"
 
-            profile.credit_amount += credit_amount
-            profile.save()
+            Profile.objects.filter(id=profile.id).update(
+                credit_amount=F("credit_amount") + credit_amount
+            )
+            profile.refresh_from_db(fields=["credit_amount"])
 
             CreditTransaction.objects.create(
                 profile=profile,
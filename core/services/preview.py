@@ -0,0 +1,48 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import UploadedImage
+from core.services import local_converter
+
+# Mesma faixa do slider de detalhe em show_image.html. O preview não debita
+# créditos, então o kernel (custo do blur) precisa ser limitado.
+MIN_DETAIL_LEVEL = 1
+MAX_DETAIL_LEVEL = 50
+
+
+def preview_cache_key(uploaded_image: UploadedImage) -> str:
+    return f"preview_gray:{uploaded_image.id}:{uploaded_image.image.name}"  # type: ignore
+
+
+def get_preview_gray(uploaded_image: UploadedImage) -> tuple[np.ndarray, float]:
+    """
+    Retorna uma cópia reduzida em cinza da imagem e a escala usada.
+
+    A cópia fica no cache (Redis) para que o slider de detalhes não precise
+    abrir o arquivo original a cada movimento.
+    """
+    key = preview_cache_key(uploaded_image)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    gray_image, scale = local_converter.read_gray(
+        uploaded_image.image.path,
+        settings.PREVIEW_MAX_SIZE,
+    )
+    cache.set(key, (gray_image, scale), settings.PREVIEW_CACHE_TIMEOUT)
+    return gray_image, scale
+
+
+def render_preview(uploaded_image: UploadedImage, detail_level: int) -> bytes:
+    detail_level = min(max(detail_level, MIN_DETAIL_LEVEL), MAX_DETAIL_LEVEL)
+    gray_image, scale = get_preview_gray(uploaded_image)
+
+    # O kernel acompanha a redução para o preview ficar parecido com o
+    # resultado em resolução cheia
+    detail_level = local_converter.normalize_detail_level(
+        round(local_converter.normalize_detail_level(detail_level) * scale)
+    )
+    sketch = local_converter.sketch_from_gray(gray_image, detail_level)
+    return local_converter.encode_jpeg(sketch)
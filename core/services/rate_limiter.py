@@ -0,0 +1,116 @@
+# Token bucket compartilhado entre todos os workers através do Redis, para
+# que as chamadas aos provedores de IA respeitem o limite da organização
+# (requisições e imagens por minuto) em vez de gerar rajadas de 429.
+
+import logging
+import threading
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# KEYS: um bucket por limite; ARGV: (capacidade, tokens por segundo, custo)
+# para cada bucket. Só consome se todos os buckets tiverem tokens, senão
+# retorna quantos segundos faltam para o mais atrasado.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local levels = {}
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local cost = tonumber(ARGV[i * 3])
+    local state = redis.call("HMGET", key, "tokens", "updated_at")
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 3 - 2])
+        local rate = tonumber(ARGV[i * 3 - 1])
+        local cost = tonumber(ARGV[i * 3])
+        redis.call("HSET", key, "tokens", levels[i] - cost, "updated_at", now)
+        redis.call("EXPIRE", key, math.ceil(capacity / rate) + 1)
+    end
+end
+
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    """
+    Limites por provedor no formato ``{"openai": {"rpm": 50, "ipm": 20}}``,
+    ``0`` ou ausente significa sem limite. A capacidade do bucket é o que se
+    acumula em ``burst_seconds``, então uma fila parada não libera um minuto
+    inteiro de chamadas de uma vez.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        limits: dict,
+        burst_seconds: float = 10.0,
+        prefix: str = "ratelimit:ai",
+    ):
+        self.client = client
+        self.limits = limits
+        self.burst_seconds = burst_seconds
+        self.prefix = prefix
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, name: str, images: int = 1) -> float:
+        """
+        Reserva uma chamada ao provedor. Retorna 0 quando liberada ou os
+        segundos a esperar antes de tentar de novo.
+        """
+        limits = self.limits.get(name) or {}
+        keys, args = [], []
+        for unit, cost in (("rpm", 1), ("ipm", images)):
+            per_minute = limits.get(unit)
+            if not per_minute:
+                continue
+            rate = per_minute / 60
+            keys.append(f"{self.prefix}:{name}:{unit}")
+            args += [max(cost, rate * self.burst_seconds), rate, cost]
+
+        if not keys:
+            return 0.0
+
+        try:
+            return float(self.script(keys=keys, args=args))
+        except redis.RedisError as error:
+            # Sem Redis não há como coordenar; melhor seguir do que parar a fila
+            logger.warning("Rate limiter unavailable: %s", error)
+            return 0.0
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    global _limiter
+    url = settings.AI_RATE_LIMIT_REDIS_URL
+    if not url.startswith(("redis://", "rediss://")):
+        return None
+
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    client=redis.Redis.from_url(url),
+                    limits=settings.AI_RATE_LIMITS,
+                    burst_seconds=settings.AI_RATE_LIMIT_BURST_SECONDS,
+                )
+    return _limiter
@@ -0,0 +1,132 @@
+# Coleta periódica de arquivos órfãos no MEDIA_ROOT (saídas antigas em
+# temp/, arquivos de linhas apagadas, conversões de livro que falharam).
+#
+# Percorre o storage diretório por diretório, em lotes de arquivos, e
+# confere cada lote contra os índices de nomes ImageBlob (originais) e
+# BlobThumbnail (miniaturas). A memória fica limitada ao tamanho do lote,
+# mesmo em diretórios enormes. Só apaga arquivos sem referência mais
+# antigos que STORAGE_GC_GRACE_SECONDS.
+
+import logging
+import os
+import posixpath
+import time
+from collections import Counter
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+from core.models import BlobThumbnail, ImageBlob, UploadedImage
+
+logger = logging.getLogger(__name__)
+
+
+def walk(
+    location: str, chunk_size: int, directory: str = ""
+) -> Iterator[tuple[str, list]]:
+    # (diretório relativo, lote de arquivos ordenado) sem carregar a
+    # listagem inteira do diretório; os subdiretórios vêm depois
+    subdirectories = []
+    files = []
+    with os.scandir(os.path.join(location, directory)) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry)
+                if len(files) >= chunk_size:
+                    yield directory, sorted(files, key=lambda file: file.name)
+                    files = []
+    if files:
+        yield directory, sorted(files, key=lambda file: file.name)
+    del files
+
+    for subdirectory in sorted(subdirectories):
+        yield from walk(location, chunk_size, posixpath.join(directory, subdirectory))
+
+
+def unreferenced(
+    directory: str,
+    files: list,
+    cutoff: float,
+    report: Counter,
+) -> list[tuple[str, int]]:
+    names = [posixpath.join(directory, entry.name) for entry in files]
+    # Blobs com ref_count 0 só esperam o delete_files
+    referenced = set(
+        ImageBlob.objects.filter(name__in=names, ref_count__gt=0).values_list(
+            "name", flat=True
+        )
+    )
+    referenced.update(
+        BlobThumbnail.objects.filter(name__in=names, blob__ref_count__gt=0).values_list(
+            "name", flat=True
+        )
+    )
+
+    candidates = []
+    for name, entry in zip(names, files):
+        report["scanned"] += 1
+        if name in referenced:
+            report["referenced"] += 1
+            continue
+
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            report["recent"] += 1
+            continue
+        candidates.append((name, stat.st_size))
+    return candidates
+
+
+def collect(
+    grace_seconds: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Apaga os arquivos do storage de imagens sem referência no banco e
+    retorna o relatório da execução.
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.STORAGE_GC_GRACE_SECONDS
+    if batch_size is None:
+        batch_size = settings.STORAGE_GC_BATCH_SIZE
+
+    storage = UploadedImage._meta.get_field("image").storage
+    started_at = time.monotonic()
+    cutoff = time.time() - grace_seconds
+    report = Counter()
+    deleted_by_directory = Counter()
+
+    if os.path.isdir(storage.location):
+        for directory, files in walk(storage.location, batch_size):
+            for name, size in unreferenced(directory, files, cutoff, report):
+                if not dry_run:
+                    try:
+                        storage.delete(name)
+                    except OSError as error:
+                        logger.warning("Could not delete %s: %s", name, error)
+                        report["errors"] += 1
+                        continue
+                report["deleted"] += 1
+                report["freed_bytes"] += size
+                top_directory = name.split("/", 1)[0] if "/" in name else "."
+                deleted_by_directory[top_directory] += 1
+
+    result = {
+        key: report[key]
+        for key in (
+            "scanned",
+            "referenced",
+            "recent",
+            "deleted",
+            "freed_bytes",
+            "errors",
+        )
+    }
+    result["deleted_by_directory"] = dict(deleted_by_directory)
+    result["dry_run"] = dry_run
+    result["duration_seconds"] = round(time.monotonic() - started_at, 2)
+    logger.info("Storage GC report: %s", result)
+    return result
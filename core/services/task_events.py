@@ -0,0 +1,71 @@
+# Notificação de conclusão das tasks de imagem via Redis pub/sub. O worker
+# publica no canal da imagem e a view SSE (ASGI) repassa ao navegador, no
+# lugar do polling em check_ai_task_status.
+
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+_client_lock = threading.Lock()
+
+
+def channel_for(uploaded_image_id: int) -> str:
+    return f"task_events:image:{uploaded_image_id}"
+
+
+def get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis.from_url(settings.TASK_EVENTS_REDIS_URL)
+    return _client
+
+
+def publish(uploaded_image_id: int, payload: dict):
+    try:
+        get_client().publish(channel_for(uploaded_image_id), json.dumps(payload))
+    except redis.RedisError as error:
+        # O navegador ainda tem o polling como alternativa
+        logger.warning("Could not publish task event: %s", error)
+
+
+@asynccontextmanager
+async def subscribe(uploaded_image_id: int) -> AsyncIterator["Subscription"]:
+    client = redis.asyncio.Redis.from_url(settings.TASK_EVENTS_REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(channel_for(uploaded_image_id))
+        yield Subscription(pubsub)
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+class Subscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def next_event(self, timeout: float) -> Optional[dict]:
+        # None quando nada chegou dentro do timeout. get_message também devolve
+        # None na confirmação da inscrição, então espera pelo tempo restante.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            message = await self.pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=remaining,
+            )
+            if message is not None:
+                return json.loads(message["data"])
+        return None
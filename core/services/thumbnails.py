@@ -0,0 +1,65 @@
+# Miniaturas em várias larguras para as grades (livro, variações, admin),
+# geradas em background e gravadas ao lado do arquivo original.
+
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from PIL import Image, ImageOps
+
+JPEG_QUALITY = 80
+
+
+def thumbnail_name(image_name: str, width: int) -> str:
+    name_no_ext = os.path.splitext(image_name)[0]
+    return f"{name_no_ext}_w{width}.jpg"
+
+
+def render_thumbnails(image: Image.Image, widths) -> dict[int, bytes]:
+    """
+    JPEGs da imagem em cada largura de ``widths`` menor que a original.
+
+    A maior largura é decodificada direto em escala reduzida (JPEG) e as
+    menores saem dela, do maior para o menor.
+    """
+    widths = sorted(widths, reverse=True)
+    if not widths:
+        return {}
+
+    image.draft("RGB", (widths[0], widths[0]))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    thumbnails = {}
+    for width in widths:
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        thumbnails[width] = buffer.getvalue()
+    return thumbnails
+
+
+def save_thumbnails(storage: Storage, image_name: str, widths=None) -> dict:
+    """
+    Gera e grava as miniaturas de ``image_name``. Retorna o mapa
+    ``{"largura": nome no storage}`` guardado em UploadedImage.thumbnails.
+    """
+    if widths is None:
+        widths = settings.THUMBNAIL_WIDTHS
+
+    with storage.open(image_name) as image_file:
+        with Image.open(image_file) as image:
+            rendered = render_thumbnails(image, widths)
+
+    names = {}
+    for width, image_bytes in rendered.items():
+        name = thumbnail_name(image_name, width)
+        if storage.exists(name):
+            storage.delete(name)
+        names[str(width)] = storage.save(name, ContentFile(image_bytes))
+    return names
@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.models import UploadedImage
+from core.services import image_blobs
+
+
+@receiver(post_save, sender=UploadedImage)
+def create_thumbnails(sender, instance: UploadedImage, created: bool, **kwargs):
+    # Só depois do commit, senão o worker pode não encontrar a linha
+    if created and instance.image:
+        from core.tasks import generate_thumbnails_task
+
+        transaction.on_commit(
+            lambda: generate_thumbnails_task.delay(instance.id)  # type: ignore
+        )
+
+
+@receiver(pre_save, sender=UploadedImage)
+def remember_image_name(sender, instance: UploadedImage, update_fields=None, **kwargs):
+    # Troca de arquivo numa linha existente (ex.: admin) move a referência
+    instance._previous_image_name = None
+    if instance.pk and (update_fields is None or "image" in update_fields):
+        instance._previous_image_name = (
+            UploadedImage.objects.filter(pk=instance.pk)
+            .values_list("image", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=UploadedImage)
+def acquire_image_blob(sender, instance: UploadedImage, created: bool, **kwargs):
+    previous_name = getattr(instance, "_previous_image_name", None)
+    if created:
+        image_blobs.acquire([instance.image.name])
+    elif previous_name is not None and previous_name != instance.image.name:
+        image_blobs.acquire([instance.image.name])
+        image_blobs.release(previous_name, instance.thumbnails.values())
+
+
+@receiver(post_delete, sender=UploadedImage)
+def release_image_blob(sender, instance: UploadedImage, **kwargs):
+    image_blobs.release(instance.image.name, instance.thumbnails.values())
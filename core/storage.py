@@ -0,0 +1,86 @@
+# Storage endereçado por conteúdo das imagens: cada arquivo é gravado em
+# ``uploads/ab/cd/<sha256>.<ext>``. O nome vem do próprio conteúdo, então
+# não há colisão nem renomeação com sufixo aleatório, e os diretórios ficam
+# com poucos arquivos mesmo com centenas de milhares de imagens.
+#
+# Arquivos derivados (ex.: miniaturas ``<sha256>_w320.jpg``) já chegam com
+# nome no layout e são gravados como estão, ao lado do original.
+
+import hashlib
+import os
+import posixpath
+import re
+from typing import Optional
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(
+    r"(?:^|/)(?P<shard>[0-9a-f]{2}/[0-9a-f]{2})/"
+    r"(?P<hash>[0-9a-f]{64})(?P<suffix>[^/.]*)(?:\.[^/]*)?$"
+)
+
+
+def file_hash(content) -> str:
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hashed_name(name: str, digest: str) -> str:
+    # Mantém o diretório base (upload_to) e a extensão do nome original
+    directory = posixpath.dirname(name)
+    extension = posixpath.splitext(name)[1].lower()
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+
+def _match(name: str):
+    match = HASHED_NAME.search(name or "")
+    if match and match["shard"].replace("/", "") == match["hash"][:4]:
+        return match
+    return None
+
+
+def is_hashed_name(name: str) -> bool:
+    return _match(name) is not None
+
+
+def name_hash(name: str) -> Optional[str]:
+    # sha256 do conteúdo a partir do nome, sem ler o arquivo (só originais)
+    match = _match(name)
+    if match and not match["suffix"]:
+        return match["hash"]
+    return None
+
+
+@deconstructible(path="core.storage.ContentAddressedStorage")
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, **kwargs):
+        # Mesmo nome é sempre o mesmo conteúdo: nunca gera nome alternativo
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        if not is_hashed_name(name):
+            name = hashed_name(str(name), file_hash(content))
+
+        if name_hash(name):
+            # Evita import circular: core.models usa este storage
+            from core.services import image_blobs
+
+            # Um release recente pode estar prestes a apagar este arquivo
+            image_blobs.cancel_pending_delete(name)
+
+        if self.exists(name):
+            # Conteúdo idêntico já gravado. Renova o mtime para a coleta de
+            # órfãos (storage_gc) não apagar o arquivo reaproveitado agora.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length=max_length)
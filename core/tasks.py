@@ -1,35 +1,444 @@
-import os
-from pathlib import Path
+import asyncio
+import functools
+import logging
+import random
+from typing import Optional
 
-from celery import shared_task
-from django.core.files import File
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from celery import Task, shared_task
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections
 
-from core.models import UploadedImage
-from core.services.design_by_openai import DesignByOpenAI
-from core.utils import use_credit_amount
+from core import metrics
+from core.models import ConversionCache, Profile, TaskStatus, UploadedImage
+from core.services import (
+    ai_clients,
+    ai_router,
+    conversion_cache,
+    image_blobs,
+    local_converter,
+    storage_gc,
+    task_events,
+    thumbnails,
+)
+from core.utils import task_status_json, use_credit_amount
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def generate_ai_image_task(uploaded_image_id: int):
+
+def finish_image_task(
+    image_id: int,
+    task_id: str,
+    task_status: str,
+    task_result: Optional[str] = None,
+):
+    # Só a task mais recente da imagem atualiza o status
+    UploadedImage.objects.filter(id=image_id, task_id=task_id).update(
+        task_status=task_status,
+        task_result=task_result,
+    )
+    task_events.publish(image_id, task_status_json(task_status, task_result))
+
+
+class ImageTask(Task):
+    """
+    Tasks cujo primeiro argumento é o id de uma UploadedImage: gravam o
+    resultado na imagem (task_status) e avisam a página dela (task_events)
+    quando terminam. Retries não avisam.
+    """
+
+    def image_id(self, args, kwargs) -> Optional[int]:
+        return kwargs.get("uploaded_image_id", args[0] if args else None)
+
+    def on_success(self, retval, task_id, args, kwargs):
+        finish_image_task(
+            self.image_id(args, kwargs),  # type: ignore
+            task_id,
+            TaskStatus.DONE,
+            retval,
+        )
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        finish_image_task(self.image_id(args, kwargs), task_id, TaskStatus.ERROR)  # type: ignore
+
+
+def fail_pending_pages(task_id: str):
+    page_ids = list(
+        UploadedImage.objects.filter(
+            task_id=task_id,
+            task_status=TaskStatus.PENDING,
+        ).values_list("id", flat=True)
+    )
+    for page_id in page_ids:
+        finish_image_task(page_id, task_id, TaskStatus.ERROR)
+
+
+class BookTask(Task):
+    """
+    Tasks de um livro inteiro cujas páginas ficam PENDING com o id da task.
+    Se a task falhar antes de terminar cada página (erro fora da página,
+    worker morto), as pendentes viram ERROR; senão as páginas esperariam
+    para sempre.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        fail_pending_pages(task_id)
+
+
+def ai_cache_key(source_hash: str, provider, image_path: str) -> str:
+    return conversion_cache.make_key(
+        source_hash,
+        kind="ai",
+        **provider.cache_params(image_path),
+    )
+
+
+def cached_ai_result(uploaded_image: UploadedImage, router) -> Optional[str]:
+    # Reaproveita uma geração anterior do mesmo conteúdo, se houver
+    image_path = uploaded_image.image.path
+    source_hash = conversion_cache.content_hash(uploaded_image.image)
+
+    for provider in router.ranked():
+        cached_image = conversion_cache.lookup(
+            ai_cache_key(source_hash, provider, image_path),
+            max_age=settings.AI_CACHE_TTL_SECONDS,
+        )
+        if cached_image and cached_image.based_on_id == uploaded_image.id:  # type: ignore
+            return cached_image.image.url
+
+        if cached_image:
+            converted_image = UploadedImage.objects.create(
+                title=f"Converted - {uploaded_image.title}",
+                image=cached_image.image.name,
+                profile=uploaded_image.profile,
+                based_on=uploaded_image,
+            )
+            use_credit_amount(uploaded_image.profile, 3, "AI_GENERATION")  # type: ignore
+            return converted_image.image.url
+
+    return None
+
+
+def save_ai_result(uploaded_image: UploadedImage, provider, image_bytes: bytes) -> str:
+    converted_image = UploadedImage.objects.create(
+        title=f"Converted - {uploaded_image.title}",
+        image=ContentFile(
+            image_bytes,
+            name=provider.output_filename(uploaded_image.image.name),
+        ),
+        profile=uploaded_image.profile,
+        based_on=uploaded_image,
+    )
+    conversion_cache.store(
+        ai_cache_key(
+            conversion_cache.content_hash(uploaded_image.image),
+            provider,
+            uploaded_image.image.path,
+        ),
+        converted_image,
+    )
+
+    use_credit_amount(uploaded_image.profile, 3, "AI_GENERATION")  # type: ignore
+    return converted_image.image.url
+
+
+@shared_task(bind=True, base=ImageTask)
+def generate_ai_image_task(self, uploaded_image_id: int, force: bool = False):
+    uploaded_image = UploadedImage.objects.get(id=uploaded_image_id)
+    router = ai_router.get_router()
+
+    if not force:
+        cached_url = cached_ai_result(uploaded_image, router)
+        if cached_url:
+            return cached_url
+
+    try:
+        provider, converted_image_bytes = router.generate(uploaded_image.image.path)
+    except ai_router.AIRateLimited as error:
+        # Volta para a fila até haver orçamento no provedor; o jitter evita
+        # que as tasks represadas acordem todas ao mesmo tempo
+        raise self.retry(
+            exc=error,
+            countdown=error.retry_after + random.uniform(0, 2),
+            max_retries=settings.AI_RATE_LIMIT_MAX_RETRIES,
+        )
+    return save_ai_result(uploaded_image, provider, converted_image_bytes)
+
+
+def orm_call(function):
+    # sync_to_async para o ORM dentro do asyncio.run de uma task: descarta
+    # antes de cada chamada a conexão vencida (CONN_MAX_AGE) ou quebrada
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        close_old_connections()
+        return function(*args, **kwargs)
+
+    return sync_to_async(call)
+
+
+@shared_task(bind=True, base=BookTask)
+def generate_book_ai_task(self, book_id: int):
+    # Todas as páginas do livro em um único worker: as chamadas aos
+    # provedores rodam concorrentes no event loop (limitadas por
+    # AI_BULK_CONCURRENCY) e cada resultado é salvo assim que chega.
+    pages = list(
+        UploadedImage.objects.filter(
+            book_id=book_id, based_on__isnull=True
+        ).select_related("profile")
+    )
+    router = ai_router.get_router()
+    # self.request é thread-local e não é visto dentro do sync_to_async
+    task_id = self.request.id
+
+    async def generate_page(page, clients, semaphore):
+        try:
+            image_url = await orm_call(cached_ai_result)(page, router)
+            if not image_url:
+                async with semaphore:
+                    provider, image_bytes = await router.agenerate(
+                        page.image.path, clients
+                    )
+                image_url = await orm_call(save_ai_result)(page, provider, image_bytes)
+            await orm_call(finish_image_task)(
+                page.id, task_id, TaskStatus.DONE, image_url
+            )
+            return True
+        except Exception as error:
+            logger.warning("AI generation failed for page %s: %s", page.id, error)
+            await orm_call(finish_image_task)(page.id, task_id, TaskStatus.ERROR)
+            return False
+
+    async def generate_all():
+        # O ORM roda numa thread só desta execução. Fora de uma request ASGI
+        # o padrão do sync_to_async é uma thread única no processo, que
+        # enfileiraria os livros de todas as threads do worker.
+        async with ThreadSensitiveContext():
+            try:
+                semaphore = asyncio.Semaphore(settings.AI_BULK_CONCURRENCY)
+                async with ai_clients.async_clients() as clients:
+                    return await asyncio.gather(
+                        *(generate_page(page, clients, semaphore) for page in pages)
+                    )
+            finally:
+                # A thread termina com o contexto: fecha a conexão dela
+                await sync_to_async(connections.close_all)()
+
+    results = asyncio.run(generate_all())
+    return {"generated": sum(results), "failed": results.count(False)}
+
+
+@shared_task(base=ImageTask)
+def local_convert_image_task(
+    uploaded_image_id: int,
+    detail_level: int = 21,
+    engine: str = "exact",
+    max_size: Optional[int] = None,
+):
     uploaded_image = UploadedImage.objects.get(id=uploaded_image_id)
     profile = uploaded_image.profile
-    designer = DesignByOpenAI(image_path=uploaded_image.image.path)
-    converted_image_path = designer.generate()
+    cache_key = conversion_cache.make_key(
+        conversion_cache.content_hash(uploaded_image.image),
+        kind="local",
+        detail_level=local_converter.normalize_detail_level(detail_level),
+        engine=engine,
+        max_size=max_size,
+    )
 
-    print(f"Converted image path: {converted_image_path}")  # Debugging line
+    # Duplo submit: as duas tasks chegam juntas em workers diferentes; com o
+    # lock a segunda espera e encontra o resultado da primeira no cache
+    with conversion_cache.conversion_lock(cache_key):
+        cached_image = conversion_cache.lookup(cache_key)
+        if cached_image and cached_image.based_on_id == uploaded_image.id:  # type: ignore
+            # Mesma imagem e mesmo nível de detalhe (ex: duplo submit)
+            return cached_image.image.url
 
-    if not converted_image_path:
-        return
+        if cached_image:
+            # Mesmo conteúdo em outra página: reaproveita o arquivo convertido
+            converted_image = UploadedImage.objects.create(
+                title=f"Converted {uploaded_image.title}",
+                image=cached_image.image.name,
+                profile=profile,
+                based_on=uploaded_image,
+            )
+            use_credit_amount(profile, 1)  # type: ignore
+            return converted_image.image.url
 
-    filename = os.path.basename(converted_image_path)
-    with open(converted_image_path, "rb") as file:
-        django_file = File(file, name=filename)
-        UploadedImage.objects.create(
-            title=f"Converted - {uploaded_image.title}",
-            image=django_file,
+        with metrics.converter_timer(uploaded_image.image.path, engine):
+            converted_image_bytes = local_converter.converter(
+                image_path=uploaded_image.image.path,
+                detail_level=detail_level,
+                engine=engine,
+                max_size=max_size,
+            )
+
+        converted_image = UploadedImage.objects.create(
+            title=f"Converted {uploaded_image.title}",
+            image=ContentFile(
+                converted_image_bytes,
+                name=local_converter.sketch_filename(uploaded_image.image.name),
+            ),
             profile=profile,
             based_on=uploaded_image,
         )
 
-    use_credit_amount(profile, 3, "AI_GENERATION")  # type: ignore
-    return converted_image_path
+        conversion_cache.store(cache_key, converted_image)
+
+        use_credit_amount(profile, 1)  # type: ignore
+        return converted_image.image.url
+
+
+@shared_task
+def convert_book_page_task(
+    uploaded_image_id: int,
+    detail_level: int = 21,
+    engine: str = "exact",
+    max_size: Optional[int] = None,
+):
+    try:
+        return convert_book_page(uploaded_image_id, detail_level, engine, max_size)
+    except Exception:
+        # Uma página com erro não pode derrubar o chord: sem cache_key,
+        # finish_book_conversion_task marca a página como ERROR e salva as
+        # demais
+        logger.exception("Book page %s conversion failed", uploaded_image_id)
+        return uploaded_image_id, None, None
+
+
+def convert_book_page(
+    uploaded_image_id: int,
+    detail_level: int,
+    engine: str,
+    max_size: Optional[int],
+):
+    uploaded_image = UploadedImage.objects.get(id=uploaded_image_id)
+    cache_key = conversion_cache.make_key(
+        conversion_cache.content_hash(uploaded_image.image),
+        kind="local",
+        detail_level=local_converter.normalize_detail_level(detail_level),
+        engine=engine,
+        max_size=max_size,
+    )
+
+    cached_image = conversion_cache.lookup(cache_key)
+    if cached_image and cached_image.based_on_id == uploaded_image_id:  # type: ignore
+        # Página já convertida com esse nível de detalhe
+        return uploaded_image_id, None, cache_key
+
+    if cached_image:
+        return uploaded_image_id, cached_image.image.name, cache_key
+
+    with metrics.converter_timer(uploaded_image.image.path, engine):
+        converted_image_bytes = local_converter.converter(
+            image_path=uploaded_image.image.path,
+            detail_level=detail_level,
+            engine=engine,
+            max_size=max_size,
+        )
+
+    # Only the file is stored here, the rows are bulk created by
+    # finish_book_conversion_task once every page of the book is done.
+    image_field = UploadedImage._meta.get_field("image")
+    filename = local_converter.sketch_filename(uploaded_image.image.name)
+    name = image_field.storage.save(
+        image_field.generate_filename(None, filename),  # type: ignore
+        ContentFile(converted_image_bytes),
+    )
+
+    return uploaded_image_id, name, cache_key
+
+
+@shared_task(bind=True, base=BookTask)
+def finish_book_conversion_task(self, results: list, profile_id: int):
+    profile = Profile.objects.get(id=profile_id)
+    converted = [result for result in results if result[1]]
+    pages = UploadedImage.objects.in_bulk([image_id for image_id, _, _ in converted])
+
+    converted_images = UploadedImage.objects.bulk_create(
+        [
+            UploadedImage(
+                title=f"Converted {pages[image_id].title}",
+                image=name,
+                profile=profile,
+                based_on=pages[image_id],
+            )
+            for image_id, name, _ in converted
+        ]
+    )
+
+    ConversionCache.objects.bulk_create(
+        [
+            ConversionCache(key=cache_key, image=converted_image)
+            for (_, _, cache_key), converted_image in zip(converted, converted_images)
+        ],
+        ignore_conflicts=True,
+    )
+    conversion_cache.evict()
+
+    # bulk_create não dispara o post_save que conta as referências e
+    # agenda as miniaturas
+    image_blobs.acquire(image.image.name for image in converted_images)
+    for converted_image in converted_images:
+        generate_thumbnails_task.delay(converted_image.id)  # type: ignore
+
+    if converted_images:
+        use_credit_amount(profile, len(converted_images), "LOCAL_BOOK")
+
+    # O id desta task é o task_id que a view gravou nas páginas
+    for (image_id, _, _), converted_image in zip(converted, converted_images):
+        finish_image_task(
+            image_id, self.request.id, TaskStatus.DONE, converted_image.image.url
+        )
+    for image_id, name, cache_key in results:
+        if name:
+            continue
+        if cache_key is None:
+            finish_image_task(image_id, self.request.id, TaskStatus.ERROR)
+            continue
+        # Página já convertida com esse nível de detalhe
+        cached = (
+            ConversionCache.objects.filter(key=cache_key)
+            .select_related("image")
+            .first()
+        )
+        finish_image_task(
+            image_id,
+            self.request.id,
+            TaskStatus.DONE,
+            cached.image.image.url if cached else None,
+        )
+    return len(converted_images)
+
+
+@shared_task
+def generate_thumbnails_task(uploaded_image_id: int):
+    uploaded_image = UploadedImage.objects.filter(id=uploaded_image_id).first()
+    if not uploaded_image or not uploaded_image.image:
+        return None
+
+    # Conversões reaproveitadas do cache apontam para o mesmo arquivo de
+    # outra linha, que já pode ter as miniaturas
+    image_thumbnails = (
+        UploadedImage.objects.filter(image=uploaded_image.image.name)
+        .exclude(id=uploaded_image_id)
+        .exclude(thumbnails={})
+        .values_list("thumbnails", flat=True)
+        .first()
+    )
+    if not image_thumbnails:
+        image_thumbnails = thumbnails.save_thumbnails(
+            uploaded_image.image.storage,
+            uploaded_image.image.name,
+        )
+
+    UploadedImage.objects.filter(id=uploaded_image_id).update(
+        thumbnails=image_thumbnails
+    )
+    image_blobs.set_thumbnails(uploaded_image.image.name, image_thumbnails.values())
+    return image_thumbnails
+
+
+@shared_task
+def collect_orphan_files_task(dry_run: bool = False):
+    # Agendada pelo celery beat (CELERY_BEAT_SCHEDULE)
+    return storage_gc.collect(dry_run=dry_run)
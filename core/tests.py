@@ -1,3 +1,1328 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import threading
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import fakeredis
+import numpy as np
+import redis
+from asgiref.sync import sync_to_async
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import ExifTags, Image, ImageDraw
+
+from bobbies_creator import celery
+from core import storage as content_storage
+from core.management.commands.benchmark_converter import synthetic_image
+from core.models import (
+    BlobThumbnail,
+    Book,
+    ConversionCache,
+    CreditTransaction,
+    ImageBlob,
+    Profile,
+    TaskStatus,
+    UploadedImage,
+)
+from core.services import (
+    ai_router,
+    conversion_cache,
+    image_preparation,
+    local_converter,
+    preview,
+    rate_limiter,
+    storage_gc,
+    task_events,
+)
+from core.services.thumbnails import thumbnail_name
+from core.tasks import (
+    ai_cache_key,
+    convert_book_page_task,
+    finish_book_conversion_task,
+    generate_ai_image_task,
+    generate_book_ai_task,
+    generate_thumbnails_task,
+    local_convert_image_task,
+)
+
+
+def make_jpeg(width: int = 320, height: int = 240, seed: int = 0) -> bytes:
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for index in range(12):
+        x = (seed * 37 + index * 53) % width
+        y = (seed * 61 + index * 29) % height
+        draw.ellipse((x, y, x + 40, y + 30), outline=(20, 20, 20), width=3)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def make_bgr(width: int = 240, height: int = 180, seed: int = 0) -> np.ndarray:
+    # Ruído suavizado: bordas e gradientes como numa foto
+    rng = np.random.default_rng(seed)
+    image = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+    return cv2.GaussianBlur(image, (9, 9), 0)
+
+
+class FakeProvider(ai_router.AIProvider):
+    def __init__(self, name: str, error=None, delay: float = 0.0, model: str = "v1"):
+        self.name = name
+        self.error = error
+        self.delay = delay
+        self.model = model
+        self.calls = 0
+
+    def result(self) -> bytes:
+        if self.error:
+            raise self.error
+        return make_jpeg(seed=self.calls)
+
+    def generate(self, image_path: str) -> bytes:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.result()
+
+    async def agenerate(self, image_path: str, client) -> bytes:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.result()
+
+    def output_filename(self, image_path: str) -> str:
+        return f"{self.name}.jpg"
+
+    def cache_params(self, image_path: str) -> dict:
+        return {"provider": self.name, "model": self.model}
+
+
+class MediaMixin:
+    # Cada teste grava as imagens em um MEDIA_ROOT temporário
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.profile = Profile.objects.create(username="author", credit_amount=100)
+        self.book = Book.objects.create(title="Book", author=self.profile)
+
+    def create_page(self, seed: int = 0, **kwargs) -> UploadedImage:
+        page = UploadedImage(
+            title=f"Page {seed}",
+            profile=self.profile,
+            book=self.book,
+            **kwargs,
+        )
+        page.image.save(f"page{seed}.jpg", ContentFile(make_jpeg(seed=seed)))
+        return page
+
+
+class MediaTestCase(MediaMixin, TestCase):
+    pass
+
+
+@mock.patch("core.tasks.task_events.publish")
+class BookConversionTests(MediaTestCase):
+    def finish(self, results: list):
+        # Como na view: páginas PENDING com o id da task final do chord
+        UploadedImage.objects.filter(
+            id__in=[image_id for image_id, _, _ in results]
+        ).update(task_id="book-task", task_status=TaskStatus.PENDING)
+        return finish_book_conversion_task.apply(
+            args=(results, self.profile.id), task_id="book-task"
+        ).get()
+
+    def test_failed_page_returns_marker_instead_of_raising(self, publish):
+        with self.assertLogs("core.tasks", level="ERROR"):
+            result = convert_book_page_task.apply(args=(0,)).get()
+
+        self.assertEqual(tuple(result), (0, None, None))
+
+    def test_failed_page_does_not_discard_converted_pages(self, publish):
+        page, failed_page = self.create_page(1), self.create_page(2)
+        results = [
+            convert_book_page_task.apply(args=(page.id, 11)).get(),
+            (failed_page.id, None, None),
+        ]
+
+        converted = self.finish(results)
+
+        self.assertEqual(converted, 1)
+        self.assertTrue(page.variations.exists())
+        self.assertFalse(failed_page.variations.exists())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.credit_amount, 99)
+
+    def test_nothing_converted_debits_nothing(self, publish):
+        page = self.create_page()
+
+        self.finish([(page.id, None, "cached")])
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.credit_amount, 100)
+        self.assertFalse(CreditTransaction.objects.exists())
+
+    def test_every_page_leaves_pending(self, publish):
+        page, converted_page, failed_page = (
+            self.create_page(1),
+            self.create_page(2),
+            self.create_page(3),
+        )
+        self.finish([convert_book_page_task.apply(args=(page.id, 11)).get()])
+        results = [
+            convert_book_page_task.apply(args=(page.id, 11)).get(),
+            convert_book_page_task.apply(args=(converted_page.id, 11)).get(),
+            (failed_page.id, None, None),
+        ]
+
+        self.finish(results)
+
+        page.refresh_from_db()
+        converted_page.refresh_from_db()
+        failed_page.refresh_from_db()
+        self.assertEqual(page.task_status, TaskStatus.DONE)
+        self.assertEqual(page.task_result, page.variations.get().image.url)
+        self.assertEqual(converted_page.task_status, TaskStatus.DONE)
+        self.assertEqual(
+            converted_page.task_result, converted_page.variations.get().image.url
+        )
+        self.assertEqual(failed_page.task_status, TaskStatus.ERROR)
+
+
+class BookImagesStatusTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.profile)
+        self.url = reverse("check_book_images_status", args=[self.book.id])
+        self.pending_page = self.create_page(1)
+        self.done_page = self.create_page(2)
+        UploadedImage.objects.filter(id=self.pending_page.id).update(
+            task_id="book-task", task_status=TaskStatus.PENDING
+        )
+        UploadedImage.objects.filter(id=self.done_page.id).update(
+            task_id="old-task", task_status=TaskStatus.DONE, task_result="/done.jpg"
+        )
+
+    def test_lists_only_pending_images(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(
+            response.json(),
+            {"images": {str(self.pending_page.id): {"status": "pending"}}},
+        )
+
+    def test_lists_requested_images(self):
+        ids = f"{self.pending_page.id},{self.done_page.id}"
+        response = self.client.get(self.url, {"ids": ids})
+
+        self.assertEqual(
+            response.json()["images"],
+            {
+                str(self.pending_page.id): {"status": "pending"},
+                str(self.done_page.id): {"status": "done", "image_path": "/done.jpg"},
+            },
+        )
+
+    def test_non_integer_ids_is_bad_request(self):
+        response = self.client.get(self.url, {"ids": "1,abc"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_book_detail_polls_while_pages_are_pending(self):
+        detail_url = reverse("book_detail", args=[self.book.id])
+
+        self.assertTrue(self.client.get(detail_url).context["has_book_task"])
+        UploadedImage.objects.filter(id=self.pending_page.id).update(
+            task_status=TaskStatus.DONE
+        )
+        self.assertFalse(self.client.get(detail_url).context["has_book_task"])
+
+
+class TaskEventsTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        for target, fake in (
+            (
+                "core.services.task_events.get_client",
+                lambda: fakeredis.FakeRedis(server=server),
+            ),
+            (
+                "core.services.task_events.redis.asyncio.Redis.from_url",
+                lambda url: fakeredis.FakeAsyncRedis(server=server),
+            ),
+        ):
+            patcher = mock.patch(target, side_effect=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.page = self.create_page(task_status=TaskStatus.PENDING)
+        self.url = reverse("ai_task_events", args=[self.page.id])
+
+    async def open_stream(self):
+        await self.async_client.aforce_login(self.profile)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return aiter(response.streaming_content)
+
+    async def test_terminal_event_closes_the_stream(self):
+        stream = await self.open_stream()
+        self.assertEqual(await anext(stream), b'data: {"status": "pending"}\n\n')
+
+        # Publicado pelo worker depois da inscrição no canal
+        await sync_to_async(task_events.publish)(
+            self.page.id, {"status": "done", "image_path": "/media/page.jpg"}
+        )
+
+        self.assertEqual(
+            await anext(stream),
+            b'data: {"status": "done", "image_path": "/media/page.jpg"}\n\n',
+        )
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    async def test_finished_task_sends_one_event(self):
+        # A task terminou antes da inscrição: nada a esperar no canal
+        await UploadedImage.objects.filter(id=self.page.id).aupdate(
+            task_status=TaskStatus.ERROR
+        )
+
+        stream = await self.open_stream()
+
+        self.assertEqual(await anext(stream), b'data: {"status": "error"}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    @override_settings(TASK_EVENTS_KEEPALIVE=0.05, TASK_EVENTS_STREAM_TIMEOUT=0.12)
+    async def test_idle_stream_sends_keepalives_until_the_timeout(self):
+        stream = await self.open_stream()
+        await anext(stream)
+
+        chunks = [chunk async for chunk in stream]
+
+        self.assertTrue(chunks)
+        self.assertEqual(set(chunks), {b": keepalive\n\n"})
+
+    async def test_other_profiles_image_is_not_found(self):
+        other = await Profile.objects.acreate(username="other")
+        await self.async_client.aforce_login(other)
+
+        response = await self.async_client.get(self.url)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_polling_still_reports_when_publish_fails(self):
+        # Sem Redis o publish só registra o erro; o navegador cai no polling
+        task_events.get_client.side_effect = None
+        task_events.get_client.return_value.publish.side_effect = redis.ConnectionError
+        UploadedImage.objects.filter(id=self.page.id).update(
+            task_status=TaskStatus.DONE, task_result="/media/page.jpg"
+        )
+
+        with self.assertLogs("core.services.task_events", "WARNING"):
+            task_events.publish(self.page.id, {"status": "done"})
+
+        self.client.force_login(self.profile)
+        response = self.client.get(reverse("check_ai_task_status", args=[self.page.id]))
+        self.assertEqual(
+            response.json(), {"status": "done", "image_path": "/media/page.jpg"}
+        )
+
+
+class BookAIGenerationTests(MediaMixin, TransactionTestCase):
+    # O ORM da task roda em outra thread, que só vê dados já commitados
+    @mock.patch("core.tasks.task_events.publish")
+    @mock.patch("core.tasks.ai_router.get_router")
+    @mock.patch("core.tasks.ai_clients.async_clients")
+    def test_failure_outside_pages_marks_pending_pages_as_error(
+        self, async_clients, get_router, publish
+    ):
+        async_clients.side_effect = RuntimeError("client setup failed")
+        get_router.return_value.ranked.return_value = []
+        pages = [self.create_page(1), self.create_page(2)]
+        other_task_page = self.create_page(3)
+        UploadedImage.objects.filter(id__in=[page.id for page in pages]).update(
+            task_id="book-task", task_status=TaskStatus.PENDING
+        )
+        UploadedImage.objects.filter(id=other_task_page.id).update(
+            task_id="other-task", task_status=TaskStatus.PENDING
+        )
+
+        result = generate_book_ai_task.apply(args=(self.book.id,), task_id="book-task")
+
+        self.assertTrue(result.failed())
+        for page in pages:
+            page.refresh_from_db()
+            self.assertEqual(page.task_status, TaskStatus.ERROR)
+        other_task_page.refresh_from_db()
+        self.assertEqual(other_task_page.task_status, TaskStatus.PENDING)
+        self.assertEqual(publish.call_count, 2)
+
+    def run_book(self, provider, task_id: str = "book-task"):
+        @asynccontextmanager
+        async def async_clients():
+            yield {provider.name: object()}
+
+        with mock.patch(
+            "core.tasks.ai_router.get_router",
+            return_value=ai_router.AIRouter([provider]),
+        ), mock.patch("core.tasks.ai_clients.async_clients", async_clients):
+            return generate_book_ai_task.apply(args=(self.book.id,), task_id=task_id)
+
+    @mock.patch("core.tasks.task_events.publish")
+    def test_top_up_during_the_run_is_kept(self, publish):
+        self.create_page(1)
+        self.create_page(2)
+        provider = FakeProvider("fake")
+        event = {
+            "type": "checkout.session.completed",
+            "data": {
+                "object": {
+                    "metadata": {"user_id": self.profile.id, "pack_id": "pack_50"}
+                }
+            },
+        }
+
+        def top_up():
+            with mock.patch(
+                "core.views.stripe_views.stripe.Webhook.construct_event",
+                return_value=event,
+            ):
+                self.client.post(
+                    reverse("stripe_webhook"), b"{}", content_type="application/json"
+                )
+
+        topped_up = []
+
+        async def agenerate(image_path, client):
+            # A recarga chega depois de o livro começar e antes dos débitos
+            if not topped_up:
+                topped_up.append(True)
+                await sync_to_async(top_up)()
+            provider.calls += 1
+            return provider.result()
+
+        provider.agenerate = agenerate
+        result = self.run_book(provider)
+
+        self.assertEqual(result.get(), {"generated": 2, "failed": 0})
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.credit_amount, 100 + 30 - 2 * 3)
+
+    @mock.patch("core.tasks.task_events.publish")
+    def test_each_run_uses_its_own_orm_thread(self, publish):
+        self.create_page(1)
+        self.create_page(2)
+        threads = []
+
+        def finish_image_task(*args):
+            threads.append(threading.current_thread().name)
+
+        with mock.patch("core.tasks.finish_image_task", finish_image_task):
+            self.run_book(FakeProvider("fake"), "first-run").get()
+            self.run_book(FakeProvider("fake"), "second-run").get()
+
+        self.assertEqual(len(threads), 4)
+        self.assertEqual(threads[0], threads[1])
+        self.assertEqual(threads[2], threads[3])
+        self.assertNotEqual(threads[0], threads[2])
+        self.assertNotIn(threading.current_thread().name, threads)
+
+
+class LocalConversionTests(MediaTestCase):
+    @mock.patch("core.tasks.task_events.publish")
+    def test_repeated_conversion_is_not_converted_or_debited_again(self, publish):
+        page = self.create_page()
+
+        with mock.patch(
+            "core.tasks.local_converter.converter",
+            wraps=local_converter.converter,
+        ) as converter:
+            first = local_convert_image_task.apply(args=(page.id, 11)).get()
+            second = local_convert_image_task.apply(args=(page.id, 11)).get()
+
+        self.assertEqual(first, second)
+        self.assertEqual(converter.call_count, 1)
+        self.assertEqual(page.variations.count(), 1)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.credit_amount, 99)
+
+
+class AIConversionCacheTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        publish = mock.patch("core.tasks.task_events.publish")
+        publish.start()
+        self.addCleanup(publish.stop)
+        self.provider = FakeProvider("fake")
+
+    def generate(self, page: UploadedImage, force: bool = False) -> str:
+        router = ai_router.AIRouter([self.provider])
+        with mock.patch("core.tasks.ai_router.get_router", return_value=router):
+            return generate_ai_image_task.apply(args=(page.id, force)).get()
+
+    def credits(self) -> int:
+        self.profile.refresh_from_db()
+        return self.profile.credit_amount
+
+    def test_repeated_generation_is_served_from_the_cache(self):
+        page = self.create_page()
+
+        first = self.generate(page)
+        second = self.generate(page)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(page.variations.count(), 1)
+        self.assertEqual(self.credits(), 97)
+
+    def test_same_content_on_another_page_reuses_the_generation(self):
+        page = self.create_page()
+        same_content_page = self.create_page()
+        self.generate(page)
+
+        self.generate(same_content_page)
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(
+            same_content_page.variations.get().image.name,
+            page.variations.get().image.name,
+        )
+
+    def test_force_bypasses_the_cache(self):
+        page = self.create_page()
+        self.generate(page)
+
+        self.generate(page, force=True)
+
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(page.variations.count(), 2)
+        self.assertEqual(self.credits(), 94)
+
+    def test_generation_older_than_the_ttl_is_not_reused(self):
+        page = self.create_page()
+        self.generate(page)
+        ConversionCache.objects.update(
+            created_at=timezone.now()
+            - timedelta(seconds=settings.AI_CACHE_TTL_SECONDS + 60)
+        )
+
+        self.generate(page)
+
+        self.assertEqual(self.provider.calls, 2)
+
+    def test_provider_or_model_change_is_a_new_key(self):
+        page = self.create_page()
+        source_hash = conversion_cache.content_hash(page.image)
+        keys = {
+            ai_cache_key(source_hash, provider, page.image.path)
+            for provider in (
+                FakeProvider("fake"),
+                FakeProvider("fake", model="v2"),
+                FakeProvider("other"),
+            )
+        }
+        self.assertEqual(len(keys), 3)
+
+        self.generate(page)
+        self.provider = FakeProvider("fake", model="v2")
+        self.generate(page)
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(page.variations.count(), 2)
+
+
+class PrepareImageTests(TestCase):
+    def prepare(self, image: Image.Image, size=(100, 100), mode=image_preparation.FIT):
+        return Image.open(BytesIO(image_preparation.prepare_image(image, size, mode)))
+
+    def jpeg(self, image: Image.Image, **save_options) -> Image.Image:
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", **save_options)
+        return Image.open(buffer)
+
+    def test_applies_exif_orientation_and_strips_metadata(self):
+        # Metade esquerda preta; orientação 6 = girar 90° no sentido horário
+        image = Image.new("RGB", (400, 200), (255, 255, 255))
+        ImageDraw.Draw(image).rectangle((0, 0, 199, 199), fill=(0, 0, 0))
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+
+        prepared = self.prepare(self.jpeg(image, exif=exif))
+
+        self.assertEqual(prepared.size, (50, 100))
+        self.assertLess(prepared.getpixel((25, 10))[0], 30)
+        self.assertGreater(prepared.getpixel((25, 90))[0], 225)
+        self.assertEqual(len(prepared.getexif()), 0)
+
+    def test_converts_every_mode_to_rgb(self):
+        transparent = Image.new("RGBA", (80, 80), (255, 0, 0, 0))
+        palette = Image.new("P", (80, 80), 0)
+        palette.putpalette([255, 0, 0] * 256)
+        palette.info["transparency"] = 0
+        cases = {
+            "L": (Image.new("L", (80, 80), 0), (0, 0, 0)),
+            "RGBA": (transparent, (255, 255, 255)),
+            "P": (palette, (255, 255, 255)),
+            "CMYK": (Image.new("CMYK", (80, 80), (0, 255, 255, 0)), (255, 0, 0)),
+        }
+
+        for mode, (image, color) in cases.items():
+            with self.subTest(mode=mode):
+                prepared = self.prepare(image)
+
+                self.assertEqual(prepared.format, "JPEG")
+                self.assertEqual(prepared.mode, "RGB")
+                for channel, expected in zip(prepared.getpixel((40, 40)), color):
+                    self.assertAlmostEqual(channel, expected, delta=8)
+
+    def test_fit_keeps_the_aspect_ratio(self):
+        prepared = self.prepare(self.jpeg(Image.new("RGB", (400, 200))))
+
+        self.assertEqual(prepared.size, (100, 50))
+
+    def test_pad_fills_to_the_target_aspect_ratio_with_white(self):
+        image = self.jpeg(Image.new("RGB", (400, 200), (0, 0, 0)))
+
+        prepared = self.prepare(image, mode=image_preparation.PAD)
+
+        self.assertEqual(prepared.size, (100, 100))
+        self.assertGreater(min(prepared.getpixel((50, 5))), 245)
+        self.assertLess(max(prepared.getpixel((50, 50))), 10)
+        self.assertGreater(min(prepared.getpixel((50, 95))), 245)
+
+    def test_never_upscales(self):
+        image = Image.new("RGB", (50, 40))
+
+        self.assertEqual(self.prepare(image).size, (50, 40))
+        self.assertEqual(self.prepare(image, mode=image_preparation.PAD).size, (50, 50))
+
+    def test_unknown_mode_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.prepare(Image.new("RGB", (50, 40)), mode="crop")
+
+
+class LocalConverterFastEngineTests(TestCase):
+    # Limites documentados em local_converter.blur_fast
+    BLUR_MAX_ERROR = 7
+    BLUR_MEAN_ERROR = 0.5
+    SKETCH_MAX_ERROR = 13
+    SKETCH_MEAN_ERROR = 0.4
+    SKETCH_P999_ERROR = 6
+
+    def test_small_detail_levels_are_exact(self):
+        inverted_image = 255 - cv2.cvtColor(make_bgr(), cv2.COLOR_BGR2GRAY)
+
+        for detail_level in (1, 21, 51):
+            with self.subTest(detail_level=detail_level):
+                np.testing.assert_array_equal(
+                    local_converter.blur_fast(inverted_image, detail_level),
+                    cv2.GaussianBlur(inverted_image, (detail_level, detail_level), 0),
+                )
+
+    def test_error_stays_within_documented_bound(self):
+        gray_image = cv2.cvtColor(synthetic_image(640, 480), cv2.COLOR_BGR2GRAY)
+        inverted_image = 255 - gray_image
+
+        for detail_level in (53, 75, 101, 151, 201, 301, 401):
+            with self.subTest(detail_level=detail_level):
+                exact = cv2.GaussianBlur(
+                    inverted_image, (detail_level, detail_level), 0
+                )
+                fast = local_converter.blur_fast(inverted_image, detail_level)
+                blur_error = np.abs(exact.astype(int) - fast.astype(int))
+
+                exact_sketch = local_converter.sketch_from_gray(
+                    gray_image, detail_level
+                )
+                fast_sketch = local_converter.sketch_from_gray(
+                    gray_image, detail_level, engine="fast"
+                )
+                sketch_error = np.abs(
+                    exact_sketch.astype(int) - fast_sketch.astype(int)
+                )
+
+                self.assertLessEqual(blur_error.max(), self.BLUR_MAX_ERROR)
+                self.assertLessEqual(blur_error.mean(), self.BLUR_MEAN_ERROR)
+                self.assertLessEqual(sketch_error.max(), self.SKETCH_MAX_ERROR)
+                self.assertLessEqual(sketch_error.mean(), self.SKETCH_MEAN_ERROR)
+                self.assertLessEqual(
+                    np.percentile(sketch_error, 99.9), self.SKETCH_P999_ERROR
+                )
+
+
+class ReadGrayTests(TestCase):
+    def write_jpeg(self, image: Image.Image, **save_options) -> str:
+        handle, path = tempfile.mkstemp(suffix=".jpg")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        image.save(path, format="JPEG", **save_options)
+        return path
+
+    def read_gray(self, path: str, max_size: int):
+        with mock.patch.object(
+            local_converter.cv2, "imread", wraps=cv2.imread
+        ) as imread:
+            gray_image, scale = local_converter.read_gray(path, max_size)
+        return gray_image, scale, imread.call_args.args[1]
+
+    def test_uses_the_largest_reduction_that_keeps_max_size(self):
+        path = self.write_jpeg(Image.new("RGB", (2000, 1000), (90, 90, 90)))
+
+        # 2000 / 4 = 500 >= 400, 2000 / 8 = 250 < 400
+        gray_image, scale, flag = self.read_gray(path, 400)
+
+        self.assertEqual(flag, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        self.assertEqual(gray_image.shape, (200, 400))
+        self.assertAlmostEqual(scale, 0.2)
+
+    def test_small_image_is_read_whole_and_not_upscaled(self):
+        path = self.write_jpeg(Image.new("RGB", (300, 200), (90, 90, 90)))
+
+        gray_image, scale, flag = self.read_gray(path, 400)
+
+        self.assertEqual(flag, cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(gray_image.shape, (200, 300))
+        self.assertEqual(scale, 1.0)
+
+    def test_exif_rotated_image_is_oriented(self):
+        # Metade esquerda preta; orientação 6 = girar 90° no sentido horário
+        image = Image.new("RGB", (800, 400), (255, 255, 255))
+        ImageDraw.Draw(image).rectangle((0, 0, 399, 399), fill=(0, 0, 0))
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        path = self.write_jpeg(image, exif=exif)
+
+        gray_image, scale, flag = self.read_gray(path, 400)
+
+        self.assertEqual(flag, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        self.assertEqual(gray_image.shape, (400, 200))
+        self.assertAlmostEqual(scale, 0.5)
+        self.assertLess(gray_image[20, 100], 30)
+        self.assertGreater(gray_image[380, 100], 225)
+
+    def test_detail_level_follows_the_scale(self):
+        path = self.write_jpeg(Image.new("RGB", (1600, 1200), (90, 90, 90)))
+
+        with mock.patch.object(
+            local_converter, "sketch_from_gray", wraps=local_converter.sketch_from_gray
+        ) as sketch_from_gray:
+            # Escala 0.25: 41 * 0.25 = 10 -> 11 (ímpar); 3 * 0.25 = 1
+            local_converter.converter(path, detail_level=41, max_size=400)
+            local_converter.converter(path, detail_level=3, max_size=400)
+
+        used_levels = [call.args[1] for call in sketch_from_gray.call_args_list]
+        self.assertEqual(used_levels, [11, 1])
+        self.assertEqual(sketch_from_gray.call_args.args[0].shape, (300, 400))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class PreviewConvertTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.page = self.create_page()
+        self.client.force_login(self.profile)
+        self.url = reverse("preview_convert", args=[self.page.id])
+
+    def test_renders_jpeg(self):
+        response = self.client.get(self.url, {"detail_level": 21})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_non_integer_detail_level_is_bad_request(self):
+        response = self.client.get(self.url, {"detail_level": "abc"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_level_is_clamped_to_slider_range(self):
+        with mock.patch(
+            "core.services.preview.local_converter.sketch_from_gray",
+            wraps=local_converter.sketch_from_gray,
+        ) as sketch_from_gray:
+            self.client.get(self.url, {"detail_level": 20001})
+            self.client.get(self.url, {"detail_level": -5})
+
+        used_levels = [call.args[1] for call in sketch_from_gray.call_args_list]
+        self.assertLessEqual(used_levels[0], preview.MAX_DETAIL_LEVEL + 1)
+        self.assertEqual(used_levels[1], 1)
+
+
+class SketchTiledTests(TestCase):
+    def test_tiled_sketch_is_identical_to_whole_image(self):
+        image = make_bgr()
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # Faixas menores que o halo com kernels grandes são lentas e não
+        # exercitam nada novo
+        cases = {
+            1: (1, 7, 64, 256),
+            3: (1, 7, 64, 256),
+            21: (1, 7, 64, 256),
+            51: (1, 7, 64, 256),
+            101: (13, 64, 256),
+            201: (37, 64, 256),
+        }
+        for detail_level, tile_sizes in cases.items():
+            expected = local_converter.sketch_from_gray(gray_image, detail_level)
+            for tile_rows in tile_sizes:
+                with self.subTest(detail_level=detail_level, tile_rows=tile_rows):
+                    sketch = local_converter.sketch_tiled(
+                        image, detail_level, tile_rows
+                    )
+                    np.testing.assert_array_equal(sketch, expected)
+
+
+class PrometheusMetricsTests(TestCase):
+    def test_disabled_without_token(self):
+        with self.settings(METRICS_TOKEN=""):
+            response = self.client.get(reverse("prometheus_metrics"))
+
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_requires_token(self):
+        url = reverse("prometheus_metrics")
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CELERY_METRICS_PORT=9808)
+class CeleryWorkerInitTests(TestCase):
+    worker = SimpleNamespace(pool_cls="threads")
+
+    @mock.patch("bobbies_creator.celery.init_process")
+    @mock.patch("bobbies_creator.celery.metrics.start_exporter")
+    def test_process_is_initialized_before_the_exporter(
+        self, start_exporter, init_process
+    ):
+        start_exporter.side_effect = RuntimeError("exporter failed")
+
+        with self.assertRaises(RuntimeError):
+            celery.init_worker(sender=self.worker)
+
+        init_process.assert_called_once_with()
+
+    @mock.patch("bobbies_creator.celery.init_process")
+    @mock.patch("bobbies_creator.celery.metrics.start_exporter")
+    def test_port_in_use_does_not_stop_the_worker(self, start_exporter, init_process):
+        start_exporter.side_effect = OSError("Address already in use")
+
+        with self.assertLogs("bobbies_creator.celery", level="WARNING"):
+            celery.init_worker(sender=self.worker)
+
+        init_process.assert_called_once_with()
+
+
+class ImageBlobTests(MediaTestCase):
+    def test_file_is_deleted_with_the_last_reference(self):
+        page, same_content_page = self.create_page(), self.create_page()
+        storage = page.image.storage
+        self.assertEqual(page.image.name, same_content_page.image.name)
+        self.assertEqual(ImageBlob.objects.get(name=page.image.name).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            page.delete()
+        self.assertTrue(storage.exists(same_content_page.image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            same_content_page.delete()
+        self.assertFalse(storage.exists(same_content_page.image.name))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_file_uploaded_again_before_the_deletion_is_kept(self):
+        page = self.create_page()
+        name = page.image.name
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            page.delete()
+        new_page = self.create_page()
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(new_page.image.name, name)
+        self.assertTrue(new_page.image.storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_save_between_release_and_acquire_keeps_the_file(self):
+        page = self.create_page()
+        storage = page.image.storage
+        name = page.image.name
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            page.delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 0)
+
+        # O upload reaproveita o arquivo antes do acquire do novo dono
+        self.assertEqual(
+            storage.save("uploads/again.jpg", ContentFile(make_jpeg())), name
+        )
+        for callback in callbacks:
+            callback()
+
+        self.assertTrue(storage.exists(name))
+        UploadedImage.objects.create(title="Again", image=name, profile=self.profile)
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_pending_blob_does_not_keep_the_file_from_the_gc(self):
+        page = self.create_page()
+        name = page.image.name
+        old = time.time() - 3600
+        os.utime(page.image.storage.path(name), (old, old))
+
+        # O delete_files não rodou (ex.: worker morreu depois do commit)
+        with self.captureOnCommitCallbacks():
+            page.delete()
+
+        storage_gc.collect(grace_seconds=60)
+        self.assertFalse(page.image.storage.exists(name))
+
+
+class StorageGCTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = UploadedImage._meta.get_field("image").storage
+
+    def save_orphan(self, seed: int = 9) -> str:
+        return self.storage.save("temp/orphan.jpg", ContentFile(make_jpeg(seed=seed)))
+
+    def age_files(self):
+        # Tudo mais antigo que o período de carência
+        old = time.time() - settings.STORAGE_GC_GRACE_SECONDS - 60
+        for directory, _, files in os.walk(self.storage.location):
+            for file in files:
+                os.utime(os.path.join(directory, file), (old, old))
+
+    def test_keeps_indexed_originals_and_thumbnails_and_deletes_old_orphans(self):
+        page = self.create_page()
+        thumbnails = generate_thumbnails_task.apply(args=(page.id,)).get()
+        orphan = self.save_orphan()
+        self.age_files()
+
+        report = storage_gc.collect(batch_size=2)
+
+        self.assertEqual(report["deleted"], 1)
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(page.image.name))
+        self.assertTrue(thumbnails)
+        for name in thumbnails.values():
+            self.assertTrue(self.storage.exists(name))
+
+    def test_keeps_thumbnails_of_legacy_images(self):
+        # Original fora do layout novo: a miniatura ganha nome de hash
+        # qualquer, sem relação com o nome do original
+        os.makedirs(os.path.join(self.storage.location, "uploads"))
+        with open(self.storage.path("uploads/legacy.jpg"), "wb") as file:
+            file.write(make_jpeg())
+        page = UploadedImage.objects.create(
+            title="Legacy", profile=self.profile, image="uploads/legacy.jpg"
+        )
+        thumbnails = generate_thumbnails_task.apply(args=(page.id,)).get()
+        self.age_files()
+
+        report = storage_gc.collect()
+
+        self.assertEqual(report["deleted"], 0)
+        for name in thumbnails.values():
+            self.assertNotIn("legacy", name)
+            self.assertTrue(self.storage.exists(name))
+
+    def test_keeps_recent_orphans(self):
+        orphan = self.save_orphan()
+
+        report = storage_gc.collect()
+
+        self.assertEqual(report["recent"], 1)
+        self.assertTrue(self.storage.exists(orphan))
+
+    def test_dry_run_deletes_nothing(self):
+        orphan = self.save_orphan()
+        self.age_files()
+
+        report = storage_gc.collect(dry_run=True)
+
+        self.assertEqual(report["deleted"], 1)
+        self.assertTrue(self.storage.exists(orphan))
+
+    def test_walk_reads_directories_in_chunks(self):
+        directory = os.path.join(self.storage.location, "temp")
+        os.makedirs(directory)
+        names = [f"file{index}.jpg" for index in range(5)]
+        for name in names:
+            open(os.path.join(directory, name), "wb").close()
+
+        chunks = list(storage_gc.walk(self.storage.location, chunk_size=2))
+
+        self.assertEqual([len(files) for _, files in chunks], [2, 2, 1])
+        self.assertEqual(
+            sorted(entry.name for _, files in chunks for entry in files), names
+        )
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.client = fakeredis.FakeRedis(server=self.server)
+
+    def limiter(self, limits: dict) -> rate_limiter.RateLimiter:
+        return rate_limiter.RateLimiter(self.client, limits, burst_seconds=10)
+
+    def test_capacity_is_what_accumulates_in_the_burst(self):
+        # 60 rpm = 1 token/s, 10 s de rajada
+        limiter = self.limiter({"openai": {"rpm": 60}})
+
+        waits = [limiter.acquire("openai") for _ in range(11)]
+
+        self.assertEqual(waits[:10], [0.0] * 10)
+        self.assertAlmostEqual(waits[10], 1.0, delta=0.05)
+
+    def test_capacity_is_never_smaller_than_the_cost(self):
+        # 6 ipm acumulam 1 imagem em 10 s: um pedido de 3 nunca passaria
+        limiter = self.limiter({"openai": {"ipm": 6}})
+
+        self.assertEqual(limiter.acquire("openai", images=3), 0.0)
+        self.assertAlmostEqual(limiter.acquire("openai", images=3), 30.0, delta=0.5)
+
+    def test_refills_with_elapsed_time(self):
+        limiter = self.limiter({"openai": {"rpm": 60}})
+        for _ in range(10):
+            limiter.acquire("openai")
+
+        # 5 s depois
+        key = "ratelimit:ai:openai:rpm"
+        updated_at = float(self.client.hget(key, "updated_at"))
+        self.client.hset(key, "updated_at", updated_at - 5)
+
+        waits = [limiter.acquire("openai") for _ in range(6)]
+        self.assertEqual(waits[:5], [0.0] * 5)
+        self.assertGreater(waits[5], 0)
+
+    def test_waits_for_the_slowest_limit_without_consuming_the_others(self):
+        limiter = self.limiter({"gemini": {"rpm": 600, "ipm": 6}})
+        self.assertEqual(limiter.acquire("gemini"), 0.0)
+        rpm_tokens = float(self.client.hget("ratelimit:ai:gemini:rpm", "tokens"))
+
+        wait = limiter.acquire("gemini")
+
+        self.assertAlmostEqual(wait, 10.0, delta=0.1)
+        self.assertEqual(
+            float(self.client.hget("ratelimit:ai:gemini:rpm", "tokens")), rpm_tokens
+        )
+
+    def test_provider_without_limits_is_not_limited(self):
+        limiter = self.limiter({"openai": {"rpm": 0}})
+
+        self.assertEqual(limiter.acquire("openai"), 0.0)
+        self.assertEqual(limiter.acquire("gemini"), 0.0)
+        self.assertEqual(self.client.keys(), [])
+
+    def test_fails_open_without_redis(self):
+        limiter = self.limiter({"openai": {"rpm": 60}})
+        self.server.connected = False
+
+        with self.assertLogs("core.services.rate_limiter", level="WARNING"):
+            self.assertEqual(limiter.acquire("openai"), 0.0)
+
+
+class AIImageTaskTests(MediaTestCase):
+    @mock.patch("core.tasks.task_events.publish")
+    def test_rate_limited_generation_is_retried(self, publish):
+        page = self.create_page()
+        limiter = mock.Mock()
+        limiter.acquire.return_value = 5.0
+        router = ai_router.AIRouter([FakeProvider("fake")], limiter=limiter)
+
+        with mock.patch(
+            "core.tasks.ai_router.get_router", return_value=router
+        ), mock.patch.object(
+            generate_ai_image_task, "retry", side_effect=Retry
+        ) as retry:
+            result = generate_ai_image_task.apply(args=(page.id,))
+
+        self.assertEqual(result.state, "RETRY")
+        countdown = retry.call_args.kwargs["countdown"]
+        self.assertGreaterEqual(countdown, 5.0)
+        self.assertLessEqual(countdown, 7.0)
+        self.assertEqual(
+            retry.call_args.kwargs["max_retries"], settings.AI_RATE_LIMIT_MAX_RETRIES
+        )
+        self.assertIsInstance(retry.call_args.kwargs["exc"], ai_router.AIRateLimited)
+
+
+class AIRouterHedgeTests(TestCase):
+    def test_rate_limited_secondary_makes_a_failed_hedge_retryable(self):
+        primary = FakeProvider("primary", error=RuntimeError("down"), delay=0.1)
+        secondary = FakeProvider("secondary")
+        limiter = mock.Mock()
+        limiter.acquire.side_effect = lambda name: 7.0 if name == "secondary" else 0.0
+        router = ai_router.AIRouter(
+            [primary, secondary], hedge_after=0.01, limiter=limiter
+        )
+
+        with self.assertRaises(ai_router.AIRateLimited) as raised:
+            router.generate("page.jpg")
+
+        self.assertEqual(raised.exception.retry_after, 7.0)
+        self.assertEqual(secondary.calls, 0)
+
+
+class ProviderRateLimitError(Exception):
+    # Como openai.RateLimitError
+    status_code = 429
+
+
+class AIRouterTests(TestCase):
+    def test_unmeasured_providers_come_first_then_by_p50(self):
+        slow, fast, new, newer = (
+            FakeProvider("slow"),
+            FakeProvider("fast"),
+            FakeProvider("new"),
+            FakeProvider("newer"),
+        )
+        router = ai_router.AIRouter([slow, fast, new, newer])
+        router.stats["slow"].record(3.0, True)
+        router.stats["fast"].record(1.0, True)
+
+        self.assertEqual(router.ranked(), [new, newer, fast, slow])
+
+    def test_unhealthy_provider_returns_after_the_cooldown(self):
+        flaky, steady = FakeProvider("flaky"), FakeProvider("steady")
+        router = ai_router.AIRouter([flaky, steady], cooldown=60)
+        router.stats["flaky"].record(1.0, False)
+        router.stats["steady"].record(2.0, True)
+
+        self.assertEqual(router.ranked(), [steady, flaky])
+
+        router.stats["flaky"].last_failure_at = time.monotonic() - 61
+        self.assertEqual(router.ranked(), [flaky, steady])
+
+    def test_fails_over_in_ranked_order(self):
+        first = FakeProvider("first", error=RuntimeError("down"))
+        second = FakeProvider("second", error=RuntimeError("down"))
+        third = FakeProvider("third")
+        router = ai_router.AIRouter([first, second, third])
+
+        provider, _ = router.generate("page.jpg")
+
+        self.assertIs(provider, third)
+        self.assertEqual((first.calls, second.calls, third.calls), (1, 1, 1))
+        self.assertEqual(router.stats["first"].error_rate, 1.0)
+
+    def test_hedge_wins_when_the_primary_is_slow(self):
+        primary = FakeProvider("primary", delay=0.5)
+        secondary = FakeProvider("secondary")
+        router = ai_router.AIRouter([primary, secondary], hedge_after=0.02)
+
+        provider, _ = router.generate("page.jpg")
+
+        self.assertIs(provider, secondary)
+
+    def test_hedge_loses_when_the_primary_answers_first(self):
+        primary = FakeProvider("primary", delay=0.05)
+        secondary = FakeProvider("secondary", delay=0.5)
+        router = ai_router.AIRouter([primary, secondary], hedge_after=0.02)
+
+        provider, _ = router.generate("page.jpg")
+
+        self.assertIs(provider, primary)
+        self.assertEqual(secondary.calls, 1)
+
+    def test_no_hedge_when_the_primary_answers_in_time(self):
+        primary, secondary = FakeProvider("primary"), FakeProvider("secondary")
+        router = ai_router.AIRouter([primary, secondary], hedge_after=1)
+
+        provider, _ = router.generate("page.jpg")
+
+        self.assertIs(provider, primary)
+        self.assertEqual(secondary.calls, 0)
+
+    def test_all_providers_failing_is_a_generation_error(self):
+        router = ai_router.AIRouter([FakeProvider("first", error=RuntimeError("down"))])
+
+        with self.assertRaises(ai_router.AIGenerationError) as raised:
+            router.generate("page.jpg")
+
+        self.assertNotIsInstance(raised.exception, ai_router.AIRateLimited)
+
+    def test_provider_429_is_rate_limited(self):
+        router = ai_router.AIRouter(
+            [FakeProvider("first", error=ProviderRateLimitError())],
+            rate_limit_retry_after=20,
+        )
+
+        with self.assertRaises(ai_router.AIRateLimited) as raised:
+            router.generate("page.jpg")
+
+        self.assertEqual(raised.exception.retry_after, 20)
+
+    def test_no_budget_is_rate_limited_with_the_shortest_wait(self):
+        limiter = mock.Mock()
+        limiter.acquire.side_effect = lambda name: {"first": 9.0, "second": 4.0}[name]
+        first, second = FakeProvider("first"), FakeProvider("second")
+        router = ai_router.AIRouter([first, second], limiter=limiter)
+
+        with self.assertRaises(ai_router.AIRateLimited) as raised:
+            router.generate("page.jpg")
+
+        self.assertEqual(raised.exception.retry_after, 4.0)
+        self.assertEqual((first.calls, second.calls), (0, 0))
+
+    def test_async_waits_for_budget_after_another_provider_failed(self):
+        failing = FakeProvider("failing", error=RuntimeError("down"))
+        waiting = FakeProvider("waiting")
+        waits = {"failing": [0.0], "waiting": [0.05, 0.0]}
+        limiter = mock.Mock()
+        limiter.acquire.side_effect = lambda name: waits[name].pop(0)
+        router = ai_router.AIRouter([failing, waiting], limiter=limiter)
+        clients = {"failing": object(), "waiting": object()}
+
+        provider, _ = asyncio.run(router.agenerate("page.jpg", clients))
+
+        self.assertIs(provider, waiting)
+        self.assertEqual(failing.calls, 1)
+
+    def test_async_fails_when_every_provider_failed(self):
+        router = ai_router.AIRouter(
+            [
+                FakeProvider("first", error=RuntimeError("down")),
+                FakeProvider("second", error=ProviderRateLimitError()),
+            ]
+        )
+        clients = {"first": object(), "second": object()}
+
+        with self.assertRaises(ai_router.AIRateLimited):
+            asyncio.run(router.agenerate("page.jpg", clients))
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = UploadedImage._meta.get_field("image").storage
+
+    def test_same_content_is_stored_once(self):
+        content = make_jpeg()
+        name = self.storage.save("uploads/first.jpg", ContentFile(content))
+        old = time.time() - 3600
+        os.utime(self.storage.path(name), (old, old))
+
+        with mock.patch.object(
+            self.storage, "_save", wraps=self.storage._save
+        ) as write:
+            same_name = self.storage.save("uploads/second.jpg", ContentFile(content))
+
+        self.assertEqual(same_name, name)
+        self.assertRegex(name, r"^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        write.assert_not_called()
+        # mtime renovado: a coleta de órfãos não apaga o arquivo reaproveitado
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), old)
+
+    def test_different_content_gets_a_different_name(self):
+        first = self.storage.save("uploads/page.jpg", ContentFile(make_jpeg(seed=1)))
+        second = self.storage.save("uploads/page.jpg", ContentFile(make_jpeg(seed=2)))
+
+        self.assertNotEqual(first, second)
+
+
+class ShardUploadsTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = UploadedImage._meta.get_field("image").storage
+        os.makedirs(self.storage.path("uploads"))
+
+    def create_legacy_image(self, name: str, content: bytes) -> UploadedImage:
+        # Imagem e miniatura no layout antigo (uploads/ plano)
+        thumbnail = f"uploads/{name}_w160.jpg"
+        with open(self.storage.path(f"uploads/{name}.jpg"), "wb") as file:
+            file.write(content)
+        with open(self.storage.path(thumbnail), "wb") as file:
+            file.write(make_jpeg(width=160, height=120))
+        return UploadedImage.objects.create(
+            title=name,
+            profile=self.profile,
+            image=f"uploads/{name}.jpg",
+            thumbnails={"160": thumbnail},
+        )
+
+    def shard(self) -> str:
+        output = StringIO()
+        call_command("shard_uploads", stdout=output)
+        return output.getvalue()
+
+    def test_moves_files_and_references_to_the_hashed_layout(self):
+        content = make_jpeg()
+        first = self.create_legacy_image("first", content)
+        second = self.create_legacy_image("second", content)
+
+        output = self.shard()
+
+        self.assertIn("1 files moved, 1 duplicates merged", output)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(content_storage.is_hashed_name(name))
+        self.assertTrue(self.storage.exists(name))
+        for legacy in ("first", "second"):
+            self.assertFalse(self.storage.exists(f"uploads/{legacy}.jpg"))
+            self.assertFalse(self.storage.exists(f"uploads/{legacy}_w160.jpg"))
+
+        # Miniaturas vão junto com o original
+        thumbnail = thumbnail_name(name, 160)
+        self.assertEqual(first.thumbnails, {"160": thumbnail})
+        self.assertEqual(second.thumbnails, {"160": thumbnail})
+        self.assertTrue(self.storage.exists(thumbnail))
+
+        # As referências passam para o nome novo
+        self.assertEqual(
+            list(ImageBlob.objects.values_list("name", "ref_count")), [(name, 2)]
+        )
+        self.assertEqual(
+            list(BlobThumbnail.objects.values_list("blob__name", "name")),
+            [(name, thumbnail)],
+        )
+
+    def test_second_run_does_nothing(self):
+        image = self.create_legacy_image("page", make_jpeg())
+        self.shard()
+        image.refresh_from_db()
+        files = sorted(
+            os.path.join(directory, file)
+            for directory, _, names in os.walk(self.storage.location)
+            for file in names
+        )
+
+        output = self.shard()
+
+        self.assertIn(
+            "0 files moved, 0 duplicates merged, 0 missing, 0 rows updated", output
+        )
+        self.assertEqual(
+            sorted(
+                os.path.join(directory, file)
+                for directory, _, names in os.walk(self.storage.location)
+                for file in names
+            ),
+            files,
+        )
+        self.assertEqual(
+            list(ImageBlob.objects.values_list("name", "ref_count")),
+            [(image.image.name, 1)],
+        )
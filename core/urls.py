@@ -5,15 +5,31 @@ from core.views import (
     page_views,
     convert_image_views,
     mercado_pago_views,
+    metrics_views,
     stripe_views,
 )
 
 urlpatterns = [
+    path(
+        "metrics",
+        metrics_views.prometheus_metrics,
+        name="prometheus_metrics",
+    ),
     path(
         "check_ai_task_status/<int:image_id>/",
         auth_views.check_ai_task_status,
         name="check_ai_task_status",
     ),
+    path(
+        "task_events/<int:image_id>/",
+        auth_views.ai_task_events,
+        name="ai_task_events",
+    ),
+    path(
+        "check_book_images_status/<int:book_id>/",
+        auth_views.check_book_images_status,
+        name="check_book_images_status",
+    ),
     path(
         "",
         page_views.home,
@@ -39,6 +55,16 @@ urlpatterns = [
         page_views.book_detail,
         name="book_detail",
     ),
+    path(
+        "book/<int:book_id>/convert/",
+        convert_image_views.convert_book,
+        name="convert_book",
+    ),
+    path(
+        "book/<int:book_id>/generate_by_ai/",
+        convert_image_views.generate_book_by_ai,
+        name="generate_book_by_ai",
+    ),
     path(
         "image/<int:image_id>/",
         page_views.show_uploaded_image,
@@ -54,6 +80,11 @@ urlpatterns = [
         convert_image_views.simple_convert,
         name="simple_convert",
     ),
+    path(
+        "image/<int:image_id>/preview/",
+        convert_image_views.preview_convert,
+        name="preview_convert",
+    ),
     path(
         "image/<int:image_id>/generate_by_ai/",
         convert_image_views.generate_by_ai,
@@ -1,11 +1,20 @@
-from core.models import Profile, CreditTransaction
+from typing import Optional
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from core import metrics
+from core.models import Profile, CreditTransaction, TaskStatus
 
 
 def use_credit_amount(profile: Profile, amount: int, origin: str = "LOCAL"):
-    profile.credit_amount -= amount
-    if profile.credit_amount < 0:
-        profile.credit_amount = 0
-    profile.save()
+    # Débito atômico no banco: salvar a instância inteira sobrescreveria
+    # recargas e outros débitos feitos desde que ela foi carregada
+    Profile.objects.filter(pk=profile.pk).update(
+        credit_amount=Greatest(F("credit_amount") - amount, 0)
+    )
+    profile.refresh_from_db(fields=["credit_amount"])
+    metrics.CREDITS_DEBITED.labels(origin).inc(amount)
 
     CreditTransaction.objects.create(
         profile=profile,
@@ -13,3 +22,14 @@ def use_credit_amount(profile: Profile, amount: int, origin: str = "LOCAL"):
         transaction_type=f"CREDIT_USE_{origin}",
     )
     return True
+
+
+def task_status_json(task_status: Optional[str], task_result: Optional[str]) -> dict:
+    # Formato devolvido pelos endpoints de status (polling, lote e SSE)
+    if task_status == TaskStatus.DONE:
+        return {"status": "done", "image_path": task_result}
+    elif task_status == TaskStatus.ERROR:
+        return {"status": "error"}
+    elif task_status == TaskStatus.PENDING:
+        return {"status": "pending"}
+    return {"status": "not_found"}
@@ -1,29 +1,112 @@
-from celery.result import AsyncResult
+import asyncio
+import json
+
+from django.conf import settings
 from django.contrib.auth import logout
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.http.response import JsonResponse
 from django.shortcuts import redirect, render
 
+from core.models import TaskStatus, UploadedImage
+from core.services import task_events
 from core.types import CustomRequest
+from core.utils import task_status_json
 
 
 # Endpoint para polling do status da task Celery
 def check_ai_task_status(request: CustomRequest, image_id: int):
-    task_id = request.session.get(f"ai_task_{image_id}")
-    if not task_id:
+    if not request.user.is_authenticated:
+        return JsonResponse({"status": "not_found"})
+
+    uploaded_image = (
+        UploadedImage.objects.filter(id=image_id, profile=request.user)
+        .only("task_status", "task_result")
+        .first()
+    )
+    if not uploaded_image:
         return JsonResponse({"status": "not_found"})
 
-    result = AsyncResult(task_id)
+    return JsonResponse(
+        task_status_json(uploaded_image.task_status, uploaded_image.task_result)
+    )
+
 
-    print(result.state)  # Debugging line to check task state
+# Status das imagens de um livro em uma única consulta: as pendentes ou,
+# com ?ids=1,2,3, as imagens pedidas (para acompanhar o progresso delas)
+def check_book_images_status(request: CustomRequest, book_id: int):
+    if not request.user.is_authenticated:
+        return JsonResponse({"images": {}})
 
-    if result.state == "SUCCESS":
-        request.session.pop(f"ai_task_{image_id}", None)
-        return JsonResponse({"status": "done", "image_path": result.result})
-    elif result.state == "FAILURE":
-        request.session.pop(f"ai_task_{image_id}", None)
-        return JsonResponse({"status": "error"})
+    images = UploadedImage.objects.filter(book_id=book_id, book__author=request.user)
+    ids = request.GET.get("ids")
+    if ids:
+        try:
+            images = images.filter(
+                id__in=[int(image_id) for image_id in ids.split(",")]
+            )
+        except ValueError:
+            return HttpResponseBadRequest(
+                "ids must be a comma separated list of integers"
+            )
     else:
-        return JsonResponse({"status": "pending"})
+        images = images.filter(task_status=TaskStatus.PENDING)
+
+    return JsonResponse(
+        {
+            "images": {
+                image_id: task_status_json(task_status, task_result)
+                for image_id, task_status, task_result in images.values_list(
+                    "id", "task_status", "task_result"
+                )
+            }
+        }
+    )
+
+
+# Server-Sent Events: envia o status assim que a task publica a conclusão
+# (task_events), sem polling. Precisa do servidor ASGI (uvicorn).
+async def ai_task_events(request: CustomRequest, image_id: int):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"status": "not_found"}, status=404)
+
+    async def current_status() -> dict:
+        uploaded_image = (
+            await UploadedImage.objects.filter(id=image_id, profile=user)
+            .only("task_status", "task_result")
+            .afirst()
+        )
+        if not uploaded_image:
+            return {"status": "not_found"}
+        return task_status_json(uploaded_image.task_status, uploaded_image.task_result)
+
+    if (await current_status())["status"] == "not_found":
+        return JsonResponse({"status": "not_found"}, status=404)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TASK_EVENTS_STREAM_TIMEOUT
+
+        async with task_events.subscribe(image_id) as subscription:
+            # A task pode ter terminado antes da inscrição no canal
+            status = await current_status()
+            yield f"data: {json.dumps(status)}\n\n"
+            if status["status"] != "pending":
+                return
+
+            while loop.time() < deadline:
+                event = await subscription.next_event(settings.TASK_EVENTS_KEEPALIVE)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+                return
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Sem buffer no nginx, senão os eventos só chegam no fim do stream
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 def landing(request: CustomRequest):
@@ -1,15 +1,39 @@
-from pathlib import Path
+from typing import Optional
 
+from celery import chord
+from celery.utils import uuid
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.files import File
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
 from django.shortcuts import redirect
 
-from core.models import UploadedImage
-from core.services import local_converter
-from core.tasks import generate_ai_image_task
+from core.models import Book, TaskStatus, UploadedImage
+from core.services import local_converter, preview
+from core.tasks import (
+    convert_book_page_task,
+    finish_book_conversion_task,
+    generate_ai_image_task,
+    generate_book_ai_task,
+    local_convert_image_task,
+)
 from core.types import CustomRequest
-from core.utils import use_credit_amount
+
+
+def get_converter_engine(request: CustomRequest) -> str:
+    engine = request.POST.get("engine", settings.LOCAL_CONVERTER_ENGINE)
+    if engine not in local_converter.ENGINES:
+        engine = settings.LOCAL_CONVERTER_ENGINE
+    return engine
+
+
+def get_max_size(request: CustomRequest) -> Optional[int]:
+    # Resolução máxima opcional da saída (lado maior, em pixels)
+    try:
+        max_size = int(request.POST.get("max_size", 0))
+    except ValueError:
+        return None
+    return max_size if max_size > 0 else None
 
 
 @login_required
@@ -42,31 +66,24 @@ def simple_convert(request: CustomRequest, image_id: int):
         return redirect("show_uploaded_image", image_id=image_id)
 
     detail_level = int(request.POST.get("detail_level", 21))
-    converted_image_path = local_converter.converter(
-        filename=uploaded_image.image.name,
-        image_path=uploaded_image.image.path,
-        detail_level=detail_level,
-    )
+    engine = get_converter_engine(request)
+    max_size = get_max_size(request)
 
-    converted_image_file = File(open(converted_image_path, "rb"))
-
-    UploadedImage.objects.create(
-        title=f"Converted {uploaded_image.title}",
-        image=converted_image_file,
-        profile=request.user,
-        based_on=uploaded_image,
+    # Celery task; o status fica na imagem antes do envio, para que a task
+    # nunca termine antes dele existir
+    task_id = uuid()
+    uploaded_image.start_task(task_id)
+    local_convert_image_task.apply_async(  # type: ignore
+        (uploaded_image.id, detail_level, engine, max_size),  # type: ignore
+        task_id=task_id,
     )
 
-    Path(converted_image_path).unlink()
-
     messages.add_message(
         request,
-        messages.SUCCESS,
-        "Art converted successfully! 🎨✨ You can see the new image below.",
+        messages.INFO,
+        "Art conversion has been started! 🎨 The new image will appear below when it's ready.",
     )
 
-    use_credit_amount(user, 1)  # type: ignore
-
     return redirect(
         "show_uploaded_image",
         image_id=uploaded_image.id,  # type: ignore
@@ -94,9 +111,14 @@ def generate_by_ai(request: CustomRequest, image_id: int):
         )
         return redirect("show_uploaded_image", image_id=image_id)
 
-    # Celery task
-    task = generate_ai_image_task.delay(uploaded_image.id)  # type: ignore
-    request.session[f"ai_task_{image_id}"] = task.id
+    # Celery task; "force" skips the cache and always calls the provider
+    force = request.GET.get("force") == "1"
+    task_id = uuid()
+    uploaded_image.start_task(task_id)
+    generate_ai_image_task.apply_async(  # type: ignore
+        (uploaded_image.id, force),  # type: ignore
+        task_id=task_id,
+    )
 
     messages.add_message(
         request,
@@ -105,3 +127,134 @@ def generate_by_ai(request: CustomRequest, image_id: int):
     )
 
     return redirect("show_uploaded_image", image_id=uploaded_image.id)  # type: ignore
+
+
+@login_required
+def convert_book(request: CustomRequest, book_id: int):
+    user = request.user
+    book = Book.objects.filter(id=book_id, author=user).first()
+
+    if not book:
+        messages.add_message(
+            request,
+            messages.ERROR,
+            "You don't have permission to view this book.",
+        )
+        return redirect("home")
+
+    if request.method != "POST":
+        return redirect("book_detail", book_id=book_id)
+
+    page_ids = list(
+        book.uploaded_images.filter(based_on__isnull=True).values_list(  # type: ignore
+            "id", flat=True
+        )
+    )
+
+    if not page_ids:
+        return redirect("book_detail", book_id=book_id)
+
+    if not user.credit_amount or user.credit_amount < len(page_ids):
+        messages.add_message(
+            request,
+            messages.ERROR,
+            "You don't have enough credits to perform this action, please buy some credits.",
+        )
+        return redirect("book_detail", book_id=book_id)
+
+    detail_level = int(request.POST.get("detail_level", 21))
+    engine = get_converter_engine(request)
+    max_size = get_max_size(request)
+
+    # Celery chord: every page is converted in parallel on the cpu queue and
+    # the rows are created in a single step once all of them are done. The
+    # pages stay PENDING with the id of that final step until it runs.
+    task_id = uuid()
+    book.uploaded_images.filter(id__in=page_ids).update(  # type: ignore
+        task_id=task_id, task_status=TaskStatus.PENDING, task_result=None
+    )
+    chord(
+        convert_book_page_task.s(  # type: ignore
+            page_id,
+            detail_level,
+            engine,
+            max_size,
+        )
+        for page_id in page_ids
+    )(
+        finish_book_conversion_task.s(user.id).set(task_id=task_id)  # type: ignore
+    )
+
+    messages.add_message(
+        request,
+        messages.INFO,
+        f"Converting {len(page_ids)} pages! 🎨 The new images will appear on each page when they are ready.",
+    )
+
+    return redirect("book_detail", book_id=book_id)
+
+
+@login_required
+def generate_book_by_ai(request: CustomRequest, book_id: int):
+    user = request.user
+    book = Book.objects.filter(id=book_id, author=user).first()
+
+    if not book:
+        messages.add_message(
+            request,
+            messages.ERROR,
+            "You don't have permission to view this book.",
+        )
+        return redirect("home")
+
+    if request.method != "POST":
+        return redirect("book_detail", book_id=book_id)
+
+    pages = book.uploaded_images.filter(based_on__isnull=True)  # type: ignore
+    page_count = pages.count()
+
+    if not page_count:
+        return redirect("book_detail", book_id=book_id)
+
+    if not user.credit_amount or user.credit_amount < page_count * 3:
+        messages.add_message(
+            request,
+            messages.ERROR,
+            "You don't have enough credits to perform this action, please buy some credits.",
+        )
+        return redirect("book_detail", book_id=book_id)
+
+    # Uma única task gera todas as páginas concorrentemente (asyncio)
+    task_id = uuid()
+    pages.update(task_id=task_id, task_status=TaskStatus.PENDING, task_result=None)
+    generate_book_ai_task.apply_async((book.id,), task_id=task_id)  # type: ignore
+
+    messages.add_message(
+        request,
+        messages.INFO,
+        f"Generating {page_count} pages with AI! 🎨 The new images will appear on each page when they are ready.",
+    )
+
+    return redirect("book_detail", book_id=book_id)
+
+
+@login_required
+def preview_convert(request: CustomRequest, image_id: int):
+    uploaded_image = UploadedImage.objects.filter(
+        id=image_id,
+        profile=request.user,
+    ).first()
+
+    if not uploaded_image:
+        return HttpResponseNotFound()
+
+    try:
+        detail_level = int(request.GET.get("detail_level", 21))
+    except ValueError:
+        return HttpResponseBadRequest("detail_level must be an integer")
+
+    preview_image = preview.render_preview(uploaded_image, detail_level)
+
+    response = HttpResponse(preview_image, content_type="image/jpeg")
+    response["Cache-Control"] = "private, max-age=3600"
+    return response
@@ -9,6 +9,7 @@ from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from core.metrics import WEBHOOK_DURATION
 from core.services.mercado_pago import get_mercado_pago_service
 from core.types import CustomRequest
 
@@ -78,6 +79,7 @@ def create_payment_preference(request: CustomRequest):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@WEBHOOK_DURATION.labels("mercado_pago").time()
 def mercado_pago_webhook(request: CustomRequest):
     try:
 
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+from core import metrics
+from core.types import CustomRequest
+
+
+def prometheus_metrics(request: CustomRequest):
+    # Sem METRICS_TOKEN o endpoint fica desligado; com ele o Prometheus
+    # precisa enviar "Authorization: Bearer <token>"
+    if not settings.METRICS_TOKEN:
+        return HttpResponseNotFound()
+    if request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponseForbidden()
+
+    content, content_type = metrics.latest()
+    return HttpResponse(content, content_type=content_type)
@@ -4,7 +4,7 @@ from django.shortcuts import redirect, render
 from django.urls import reverse
 
 from core.forms import ImageUploadForm
-from core.models import Book, UploadedImage
+from core.models import Book, TaskStatus, UploadedImage
 from core.types import CustomRequest
 
 
@@ -36,10 +36,17 @@ def book_detail(request: CustomRequest, book_id: int):
         return redirect("home")
 
     uploaded_images = book.uploaded_images.all().order_by("-id")  # type: ignore
+    has_book_task = book.uploaded_images.filter(  # type: ignore
+        task_status=TaskStatus.PENDING
+    ).exists()
     return render(
         request,
         "core/book_detail.html",
-        {"book": book, "uploaded_images": uploaded_images},
+        {
+            "book": book,
+            "uploaded_images": uploaded_images,
+            "has_book_task": has_book_task,
+        },
     )
 
 
@@ -129,7 +136,7 @@ def show_uploaded_image(request: CustomRequest, image_id: int):
         )
         return redirect("home")
 
-    has_imagem_task = request.session.get(f"ai_task_{image_id}") is not None
+    has_imagem_task = uploaded_image.has_pending_task
 
     return render(
         request,
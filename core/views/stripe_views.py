@@ -4,12 +4,14 @@ import stripe
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import F
 from django.http.response import JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from core.metrics import WEBHOOK_DURATION
 from core.models import Profile
 from core.types import CustomRequest
 
@@ -70,6 +72,7 @@ def stripe_create_checkout_session(request: CustomRequest):
 
 @csrf_exempt
 # @require_http_methods(["GET", "POST"])
+@WEBHOOK_DURATION.labels("stripe").time()
 def stripe_webhook(request: CustomRequest):
     payload = request.body
 
@@ -105,8 +108,9 @@ def stripe_webhook(request: CustomRequest):
             )
 
             if pack:
-                profile.credit_amount += pack["credits"]
-                profile.save()
+                Profile.objects.filter(id=profile.id).update(
+                    credit_amount=F("credit_amount") + pack["credits"]
+                )
                 messages.add_message(
                     request,
                     messages.SUCCESS,